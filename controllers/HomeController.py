@@ -9,6 +9,7 @@ from PySide6.QtWidgets import QFileDialog, QMessageBox, QDialog, QMenu
 
 from views.HomeView import HomeView
 from cores.HomeCore import HomeCore
+from controllers.RenderWorker import RenderWorker
 from views.popups.PopUpMsg import PopUpMsg
 from views.tools.url import UrlPopUp
 from views.tools.ai import AiPopUp
@@ -25,6 +26,7 @@ class HomeController:
     pop_url: UrlPopUp
     pop_ai: AiPopUp
     pop_rec: RecordPopUp
+    render_worker: RenderWorker
 
     def __init__(self):
         super().__init__()
@@ -33,6 +35,8 @@ class HomeController:
         self.pop_url = UrlPopUp()
         self.pop_ai = AiPopUp()
         self.pop_rec = RecordPopUp()
+        self.render_worker = RenderWorker()
+        self.render_worker.idle.connect(self.renders_finished)
 
         # Connect signals
 
@@ -82,6 +86,7 @@ class HomeController:
 
         self.view.multiplayer_slider.sliderPressed.connect(self.music_slider_clicked)
         self.view.multiplayer_slider.sliderReleased.connect(self.music_slider_changed)
+        self.view.multiplayer_slider.sliderMoved.connect(self.music_slider_moved)
 
         self.view.main_volume_slider.valueChanged.connect(self.set_main_volume)
 
@@ -220,6 +225,12 @@ class HomeController:
         self.playback_timer.stop()
         self.core.pause_multiplayer()
 
+    def music_slider_moved(self, value: int) -> None:
+        """Moves the paused playback along with the slider, so the time label follows the scrubbing."""
+
+        self.core.multiplayer.set_time(value)
+        self.view.playing_time_label.setText("{:02}:{:02}:{:02}".format(*self.core.get_current_time()))
+
     def music_slider_changed(self) -> None:
         """Resumes the playback when the slider is released."""
 
@@ -306,6 +317,22 @@ class HomeController:
         player_name = self.view.created_players_list.currentItem().text()
         volume = self.view.audio_volume_slider.value()
         self.core.set_volume_on_sound(player_name, selected_audio, volume)
+        self.render_in_background(player_name, selected_audio)
+
+    def render_in_background(self, player_name: str, selected_audio: str) -> None:
+        """Renders the edits of the selected audio in the background once the user stops changing them.
+        Playback can not be started until the render is finished."""
+
+        if self.view.play_button.text() == "Play":
+            self.view.play_button.setEnabled(False)
+        self.render_worker.schedule(player_name, selected_audio,
+                                    lambda: self.core.get_sound_in_player(player_name, selected_audio))
+
+    def renders_finished(self) -> None:
+        """Enables the playback once the background renders are finished."""
+
+        if self.view.play_button.text() == "Play":
+            self.view.play_button.setEnabled(self.check_if_audio())
 
     def set_audio_delay(self) -> None:
         """Sets the delay of the selected audio in the selected player."""
@@ -383,7 +410,9 @@ class HomeController:
             self.view.show_plot(None)
 
     def set_band(self, band, ind):
-        """Sets the band of the equalizer in the selected audio."""
+        """Sets the band of the equalizer in the selected audio.
+        Nothing is rendered: a playing sound is equalized from its next block on,
+        and the next playback equalizes the sound while it plays."""
 
         if self.view.audios_in_player_list.selectedItems():
             self.view.audio_volume_slider.setValue(60)
@@ -459,6 +488,12 @@ class HomeController:
 
         menu.exec_(self.view.audios_in_player_list.mapToGlobal(pos))
 
+    def close(self) -> None:
+        """Releases the audio device when the application quits."""
+
+        self.playback_timer.stop()
+        self.core.close()
+
     def set_main_volume(self) -> None:
         """Sets the main volume of the player."""
         volume = self.view.main_volume_slider.value()
@@ -471,6 +506,7 @@ class HomeController:
         del state['pop_ai']
         del state['pop_rec']
         del state['playback_timer']
+        del state['render_worker']
         return state
 
     def save_project(self) -> None:
@@ -485,6 +521,8 @@ class HomeController:
             with open('secret.pkl', 'rb') as f:
                 controller = pickle.load(f)
 
+            self.stop_multiplayer()
+            self.core.close()
             self.core = controller.core
 
             self.view.update_file_list(self.core.files)
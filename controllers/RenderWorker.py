@@ -0,0 +1,70 @@
+from collections.abc import Callable
+from concurrent.futures import Future, ThreadPoolExecutor
+
+from PySide6.QtCore import QObject, QTimer, Signal
+
+from models.audio_edit.AudioFile import AudioFile
+from models.audio_edit.render_scheduler import render_scheduler
+
+
+class RenderWorker(QObject):
+    """
+    Renders the edits of sounds in a background thread while the user is still changing them.
+    Changes arriving within the debounce interval are coalesced into one render,
+    and a queued render of a sound which was changed again is cancelled.
+    The sounds changed together are rendered as one batch by the render scheduler, in parallel processes.
+    """
+
+    idle = Signal()  # Emitted once no render is scheduled or running
+    _finished = Signal(object, object)  # Key and future of a finished render, moves the result to the GUI thread
+
+    _timer: QTimer  # Fires once the changes paused for the debounce interval
+    _scheduled: dict[tuple[str, str], Callable[[], AudioFile | None]]  # Getter of the latest version of each sound
+    _running: dict[tuple[str, str], Future]  # Submitted render batch of each sound
+    _executor: ThreadPoolExecutor  # Single thread, so queued renders can still be cancelled
+
+    def __init__(self, debounce_ms: int = 150, parent: QObject | None = None):
+        super().__init__(parent)
+        self._scheduled = {}
+        self._running = {}
+        self._executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="render-worker")
+        self._timer = QTimer(self)
+        self._timer.setSingleShot(True)
+        self._timer.setInterval(debounce_ms)
+        self._timer.timeout.connect(self._start_renders)
+        self._finished.connect(self._on_finished)
+
+    @property
+    def is_busy(self) -> bool:
+        return bool(self._scheduled or self._running)
+
+    def schedule(self, player_name: str, sound_id: str, get_sound: Callable[[], AudioFile | None]) -> None:
+        """
+        Schedules the render of the sound returned by get_sound once the changes pause.
+        """
+        key = (player_name, sound_id)
+        self._scheduled[key] = get_sound
+        running = self._running.get(key)
+        if running is not None and sum(future is running for future in self._running.values()) == 1:
+            running.cancel()  # Only succeeds if the render has not started yet, a batch with other sounds is kept
+        self._timer.start()
+
+    def _start_renders(self) -> None:
+        sounds = {key: get_sound() for key, get_sound in self._scheduled.items()}
+        sounds = {key: sound for key, sound in sounds.items() if sound is not None and not sound.is_rendered}
+        self._scheduled.clear()
+        if sounds:
+            future = self._executor.submit(render_scheduler.render, list(sounds.values()))
+            for key in sounds:
+                self._running[key] = future
+                future.add_done_callback(lambda done, key=key: self._finished.emit(key, done))
+        self._emit_if_idle()
+
+    def _on_finished(self, key: tuple[str, str], future: Future) -> None:
+        if self._running.get(key) is future:
+            self._running.pop(key)
+        self._emit_if_idle()
+
+    def _emit_if_idle(self) -> None:
+        if not self.is_busy:
+            self.idle.emit()
@@ -26,10 +26,11 @@ class HomeCore:
         self.multiplayer = MultiPlayer()
 
     def add_file(self, file_path: str) -> None:
-        """Adds an audio file to the file list. If the file already exists, a copy is created."""
+        """Adds an audio file to the file list. If the file already exists, a copy is created.
+        The file is decoded only once it is placed into a player or exported."""
 
         file_name = file_path.split("/")[-1].split(".")[0]
-        audio_file = read_audio_file(file_path)
+        audio_file = read_audio_file(file_path, lazy=True)
         if file_name not in self.files:
             self.files[file_name] = audio_file
         else:
@@ -63,9 +64,12 @@ class HomeCore:
         return False
 
     def combine_audio_files(self) -> None:
-        """Combines all audio files from the selected player."""
-        for player in self.players.values():
-            player.combine_audio_files()
+        """Combines all audio files from the selected player.
+        All players are combined in the highest frame rate and channel count of the project,
+        so the multiplayer mixes them without conversion. Nothing is rendered here,
+        the sounds are rendered once the playback reaches them.
+        Players which did not change since the last combine keep their timelines."""
+        self.multiplayer.combine_audio_files()
 
     def play_multiplayer(self, volume: float) -> None:
         """Plays all the audio files from all the players."""
@@ -87,6 +91,11 @@ class HomeCore:
 
         self.multiplayer.stop_all()
 
+    def close(self) -> None:
+        """Stops the playback and releases the audio device of the project."""
+
+        self.multiplayer.terminate()
+
     def get_max_length_in_seconds(self) -> int:
         """Returns the maximum length of all audio files."""
 
@@ -124,6 +133,12 @@ class HomeCore:
             return self.players[player_name].get_audio_delay(selected_audio)
         return 0
 
+    def get_sound_in_player(self, player_name: str, selected_audio: str) -> AudioFile | None:
+        """Returns the current version of the selected audio in the selected player."""
+        if player_name in self.players:
+            return self.players[player_name].sound_files.get(selected_audio)
+        return None
+
     def set_volume_on_sound(self, player_name: str, selected_audio: str, volume: float) -> None:
         """Sets the volume of the selected audio in the selected player."""
         if player_name in self.players:
@@ -154,10 +169,7 @@ class HomeCore:
         """Removes all filters from the selected audio in the selected player."""
 
         if player_name in self.players:
-            new_audio = AudioFile.combine_with_audio_segment(self.players[player_name].sound_files[selected_audio],
-                                                             self.files[selected_audio])
-            new_audio.filters = []
-            self.players[player_name].load(selected_audio, new_audio)
+            self.players[player_name].remove_filters(selected_audio)
 
     def add_to_pixel_maps(self, name: str, file_path: str, analyzer: object, function_name: callable) -> None:
         """Adds a plot to the plot list. If the plot already exists, a copy is created."""
@@ -9,5 +9,6 @@ from views.HomeView import HomeView
 if __name__ == '__main__':
     app = QApplication(sys.argv)
     controller = HomeController()
+    app.aboutToQuit.connect(controller.close)
     controller.show()
     sys.exit(app.exec())
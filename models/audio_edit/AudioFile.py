@@ -1,8 +1,20 @@
 from pydub import AudioSegment
+import numpy as np
+import array
+import functools
+import hashlib
 import math
+import mmap
 import io
-from models.audio_edit.filters import FilterType
+import os
+import threading
+from models.audio_edit.filters import FilterType, cast_to_scaled_int16
+from models.audio_edit.pipeline import FilterPipeline
 from models.audio_edit.equalizer import Equalizer
+from models.audio_edit.render_cache import render_cache
+from models.audio_io.decoding import probe_audio_file
+
+_SAMPLE_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}  # NumPy types of the samples for each sample width
 
 
 class AudioFile(AudioSegment):
@@ -14,43 +26,282 @@ class AudioFile(AudioSegment):
     volume: float  # Volume of the audio file
     filters: list[FilterType]  # List of filters to apply to the audio file
     equalizer: Equalizer  # Equalizer object to adjust the audio file
+    source: AudioSegment | None  # Unedited audio this file was created from, sharing its samples until an edit
+    _pending_load: functools.partial | None  # Loader of a lazy audio file which has not been decoded yet
+    _pending_frames: int  # Probed number of frames of a lazy audio file
+    _pending_render: bool  # True if the edits were changed and are rendered from the source on first access
+    _content_hash: str | None  # Hash of the samples, computed on first use
+    _raw_file: tuple[str, int, int] | None  # Path, size and modification time of the memory mapped raw PCM file
+    _render_lock: threading.RLock  # Guards the render against renders of the same file in other threads
 
-    def __init__(self, data=None, delay=0, filters=None, volume: float = 100, equalizer=None, *args,
+    def __init__(self, data=None, delay=0, filters=None, volume: float = 100, equalizer=None, source=None, *args,
                  **kwargs):
+        self._pending_load = None
+        self._pending_frames = 0
+        self._pending_render = False
+        self._content_hash = None
+        self._raw_file = None
+        self._render_lock = threading.RLock()
         super().__init__(data, *args, **kwargs)
         filters = filters or []
         self.delay = delay
         self.volume = volume
         self.filters = filters
-        self.equalizer = Equalizer(self) if not equalizer else equalizer
+        self.equalizer = Equalizer(self) if not equalizer else equalizer.bind(self)
+        self.source = source
 
     @classmethod
     def from_segment(cls, segment: AudioSegment):
-        return cls(segment._data, frame_rate=segment.frame_rate, sample_width=segment.sample_width,
-                   channels=segment.channels)
-
-    @classmethod
-    def from_audiofile(cls, audiofile):
-        return cls(audiofile._data, frame_rate=audiofile.frame_rate, sample_width=audiofile.sample_width,
-                   channels=audiofile.channels, filters=audiofile.filters, delay=audiofile.delay,
-                   volume=audiofile.volume, equalizer=audiofile.equalizer)
+        """
+        Creates an unedited audio file which references the samples of the segment instead of copying them.
+        """
+        data = segment._data
+        source = segment
+        if not isinstance(segment, AudioFile):
+            source = cls(data, frame_rate=segment.frame_rate, sample_width=segment.sample_width,
+                         channels=segment.channels)
+        elif segment.source is not None and not segment.is_modified:
+            source = segment.source
+        return cls(data, frame_rate=segment.frame_rate, sample_width=segment.sample_width,
+                   channels=segment.channels, source=source)
 
     @classmethod
-    def from_file(cls, file_path: str):
-        return cls.from_segment(AudioSegment.from_file(file_path))
+    def from_file(cls, file_path: str, lazy: bool = False, loader=AudioSegment.from_file):
+        """
+        Reads the audio file with the given loader. A lazy audio file only probes the duration, channels,
+        frame rate and sample width, and runs the loader on the first access to its samples.
+        """
+        if not lazy:
+            return cls.from_segment(loader(file_path))
+        info = probe_audio_file(file_path)
+        audio_file = cls(b'', frame_rate=info["frame_rate"], sample_width=info["sample_width"],
+                         channels=info["channels"])
+        audio_file._pending_load = functools.partial(loader, file_path)
+        audio_file._pending_frames = info["frames"]
+        return audio_file
 
     @classmethod
-    def combine_with_audio_segment(cls, audiofile, audio_segment: AudioSegment):
-        return cls(audio_segment._data, frame_rate=audio_segment.frame_rate, sample_width=audio_segment.sample_width,
-                   channels=audio_segment.channels, delay=audiofile.delay,
-                   volume=audiofile.volume, filters=audiofile.filters, equalizer=audiofile.equalizer)
+    def from_raw_file(cls, file_path: str, frame_rate: int, sample_width: int, channels: int):
+        """
+        Creates an audio file backed by a memory map of the raw PCM file instead of an in-memory copy.
+        The samples are paged in by the OS on access and shared by every AudioFile created from it.
+        """
+        with open(file_path, 'rb') as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+            stat = os.fstat(f.fileno())
+        audio_file = cls(data, frame_rate=frame_rate, sample_width=sample_width, channels=channels)
+        audio_file._raw_file = (file_path, stat.st_size, stat.st_mtime_ns)
+        return audio_file
 
     def _spawn(self, data: bytes, overrides={}):
         """
         Spawns a new AudioFile object with the given data and overrides.
         """
-        return self.__class__(data, frame_rate=self.frame_rate, sample_width=self.sample_width,
-                              channels=self.channels, delay=self.delay, volume=self.volume, filters=self.filters, equalizer=self.equalizer)
+        if isinstance(data, list):
+            data = b''.join(data)
+        metadata = {"sample_width": self.sample_width, "frame_rate": self.frame_rate,
+                    "frame_width": self.frame_width, "channels": self.channels} | overrides
+        return self.__class__(data, delay=self.delay, volume=self.volume, filters=self.filters,
+                              equalizer=self.equalizer, metadata=metadata)
+
+    @property
+    def _data(self):
+        if self._pending_load is not None:
+            self._load_pending()
+        if self._pending_render:
+            self._render()
+        return self._pcm
+
+    @_data.setter
+    def _data(self, data):
+        self._pcm = data
+
+    def _load_pending(self) -> None:
+        """
+        Decodes a lazy audio file. The decoded parameters replace the probed ones.
+        """
+        decoded = self._pending_load()
+        self._pending_load = None
+        self._pcm = decoded._data
+        self._content_hash = getattr(decoded, '_content_hash', None)
+        self.frame_rate = decoded.frame_rate
+        self.sample_width = decoded.sample_width
+        self.channels = decoded.channels
+        self.frame_width = decoded.frame_width
+        self.equalizer._fs = decoded.frame_rate
+        self.equalizer._channels = decoded.channels
+        self.equalizer._sample_width = decoded.sample_width
+
+    def edited(self, **edits):
+        """
+        Spawns the audio file with the given edits (delay, volume, filters, equalizer) replaced.
+        Nothing is rendered here, the source is rendered with all edits once the samples are used.
+        """
+        source = self.source if self.source is not None else self
+        params = {"delay": self.delay, "volume": self.volume, "filters": self.filters,
+                  "equalizer": self.equalizer} | edits
+        quantised = bool(params["filters"]) or not params["equalizer"].is_flat()
+        audio_file = self.__class__(b'', frame_rate=source.frame_rate, channels=source.channels,
+                                    sample_width=2 if quantised else source.sample_width, source=source, **params)
+        audio_file._pending_render = True
+        return audio_file
+
+    def _render(self) -> None:
+        """
+        Renders the source with the filters, the equalizer and the volume in a single pass.
+        An audio file without edits keeps sharing the samples of its source.
+        A render running in another thread is waited for instead of being computed again.
+        """
+        with self._render_lock:
+            if self._pending_render and not self.render_from_cache():
+                self.set_rendered(self.compute_render())
+
+    def render(self) -> None:
+        """
+        Renders the pending edits now instead of on the first use of the samples.
+        """
+        if self._pending_render:
+            self._render()
+
+    def _source_file(self):
+        return self.source if isinstance(self.source, AudioFile) else AudioFile.from_segment(self.source)
+
+    @property
+    def is_rendered(self) -> bool:
+        return not self._pending_render
+
+    def render_from_cache(self) -> bool:
+        """
+        Finishes the render without computing it, if the audio file has no edits or its render is cached.
+        Returns True if the audio file is rendered.
+        """
+        with self._render_lock:
+            if not self._pending_render:
+                return True
+            source = self._source_file()
+            if not self.filters and self.equalizer.is_flat() and self.volume == 100:
+                data = source._data
+            else:
+                data = render_cache.get(render_cache.key(source, self.filters, self.equalizer, self.volume))
+                if data is None:
+                    return False
+            self._pcm = data  # Set before the flag, a reader in another thread must not get the empty data
+            self._pending_render = False
+            return True
+
+    def compute_render(self) -> bytes:
+        """
+        Computes the data of the source rendered with the edits, without storing it.
+        """
+        source = self._source_file()
+        gain = self.volume_gain
+        if self.filters or not self.equalizer.is_flat():
+            spectrum_key = render_cache.filtered_key(source, self.filters)
+            samples = None if self.equalizer.is_flat() else self.equalizer.process_cached(spectrum_key)
+            if samples is None:
+                samples = FilterPipeline(source, self.filters).process(source.get_float_samples())
+                samples = self.equalizer.process(samples, spectrum_key)
+            samples = cast_to_scaled_int16(samples, gain)
+        else:
+            samples = source.get_samples_view()
+            limits = np.iinfo(samples.dtype)
+            samples = np.clip(samples * gain, limits.min, limits.max).astype(samples.dtype)
+        return samples.tobytes()
+
+    @property
+    def volume_gain(self) -> float:
+        """
+        Returns the linear gain the volume of the audio file is rendered with.
+        """
+        return 10 ** ((-40.0 * math.log10(100 / self.volume) if self.volume > 0 else -80) / 20)
+
+    def set_rendered(self, data: bytes) -> None:
+        """
+        Stores the computed render of the edits as the data of the audio file and in the render cache.
+        """
+        with self._render_lock:
+            self._pcm = data  # Set before the flag, a reader in another thread must not get the empty data
+            self._pending_render = False
+        render_cache.put(render_cache.key(self._source_file(), self.filters, self.equalizer, self.volume), data)
+
+    def content_hash(self) -> str:
+        """
+        Returns the hash of the samples. It is computed once per audio file.
+        """
+        if self._content_hash is None:
+            self._content_hash = hashlib.blake2b(self._data, digest_size=20).hexdigest()
+        return self._content_hash
+
+    @property
+    def is_loaded(self) -> bool:
+        return self._pending_load is None
+
+    def frame_count(self, ms=None):
+        """
+        Returns the number of frames. Lazy audio files use the probed length, so they are not decoded.
+        """
+        if ms is None and self._pending_load is not None:
+            return float(self._pending_frames)
+        if ms is None and self._pending_render:
+            return self.source.frame_count()
+        return super().frame_count(ms)
+
+    def get_float_samples(self) -> np.ndarray:
+        """
+        Returns the samples as float32 in the range of -1 to 1.
+        """
+        samples = self.get_samples_view().astype(np.float32)
+        samples *= np.float32(1 / (1 << (8 * self.sample_width - 1)))
+        return samples
+
+    @property
+    def is_modified(self) -> bool:
+        """
+        True if an edit was rendered, so the file no longer shares the samples of its source.
+        """
+        return self.source is not None and self._data is not self.source._data
+
+    @property
+    def raw_file(self) -> str | None:
+        """
+        Path of the raw PCM file the samples are memory mapped from, None if the file was removed or changed since.
+        """
+        if self._raw_file is None:
+            return None
+        path, size, mtime = self._raw_file
+        try:
+            stat = os.stat(path)
+        except OSError:
+            return None
+        return path if (stat.st_size, stat.st_mtime_ns) == (size, mtime) else None
+
+    @property
+    def is_memory_mapped(self) -> bool:
+        return isinstance(self._data, mmap.mmap)
+
+    def get_samples_view(self) -> np.ndarray:
+        """
+        Returns a read-only NumPy view of the samples without copying the audio data.
+        """
+        if self.sample_width not in _SAMPLE_DTYPES:
+            return np.array(self.get_array_of_samples())
+        return np.frombuffer(self._data, dtype=_SAMPLE_DTYPES[self.sample_width])
+
+    def get_array_of_samples(self, array_type_override=None):
+        """
+        Returns the samples as an array, also for memory mapped data.
+        """
+        samples = array.array(array_type_override or self.array_type)
+        samples.frombytes(self._data)
+        return samples
+
+    def append(self, seg, crossfade=100):
+        """
+        Appends the given segment. Memory mapped data can't be concatenated directly, so it is joined as bytes.
+        """
+        if not isinstance(self._data, bytes):
+            return self._spawn(bytes(self._data)).append(seg, crossfade)
+        return super().append(seg, crossfade)
 
     def to_buffer(self, format: str = "mp3"):
         """
@@ -84,28 +335,21 @@ class AudioFile(AudioSegment):
         """
         Sets the volume of the audio file.
         """
-        current_gain = -40.0 * math.log10(100 / self.volume) if self.volume > 0 else -80
-
-        target_gain = -40.0 * math.log10(100 / volume) if volume > 0 else -80
-
-        gain_adjustment = target_gain - current_gain
-
-        adjusted_audio_segment = self.apply_gain(gain_adjustment)
-
-        self.volume = volume
-
-        return self.combine_with_audio_segment(self, adjusted_audio_segment)
+        return self.edited(volume=volume)
 
     def apply_filter(self, filter_type: FilterType):
         """
         Applies the given filter to the audio file.
         :return: AudioFile
         """
-        self.filters.append(filter_type)
-        new_audio = filter_type.create_filter(self)
-        new_audio.equalizer.segment = new_audio
-        new_audio.equalizer._samples = new_audio.get_array_of_samples()
-        return new_audio
+        return self.edited(filters=self.filters + [filter_type])
+
+    def remove_filters(self):
+        """
+        Removes all filters from the audio file, keeping the other edits.
+        :return: AudioFile
+        """
+        return self.edited(filters=[])
 
     def set_value_on_band(self, band, value: float):
         """
@@ -119,3 +363,35 @@ class AudioFile(AudioSegment):
         Returns all bands of the equalizer.
         """
         return self.equalizer.get_all_bands()
+
+    def __getstate__(self):
+        if self._pending_load is not None:  # A project has to keep the samples, the source file may be moved
+            self._load_pending()
+        state = self.__dict__.copy()
+        del state['_render_lock']
+        if self.source is not None and self._pcm is self.source._data:
+            state['_pcm'] = None  # Restored from the source, so shared samples are saved only once
+        elif not isinstance(state['_pcm'], bytes):
+            state['_pcm'] = bytes(state['_pcm'])
+        state['_raw_file'] = None  # The samples are saved, the raw file may be evicted from the cache
+        return state
+
+    def __setstate__(self, state):
+        if '_data' in state:  # Projects saved before lazy loading stored the samples as _data
+            state['_pcm'] = state.pop('_data')
+        legacy = 'source' not in state  # Projects saved before the edit list stored the edits baked into the samples
+        state.setdefault('_pending_load', None)
+        state.setdefault('_pending_frames', 0)
+        state.pop('_pending_samples', None)  # Field of earlier versions, always saved quantised
+        state.setdefault('_pending_render', False)
+        state.setdefault('_content_hash', None)
+        state.setdefault('_raw_file', None)
+        state['_render_lock'] = threading.RLock()
+        state.setdefault('source', None)
+        if state['_pcm'] is None:
+            state['_pcm'] = state['source']._data
+        self.__dict__.update(state)
+        if legacy:  # The baked samples become the unedited source, so the edits are not applied a second time
+            self.filters = []
+            self.volume = 100
+            self.equalizer = Equalizer(self)
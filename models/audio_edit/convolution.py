@@ -0,0 +1,84 @@
+import functools
+
+import numpy as np
+from pydub import AudioSegment
+from scipy import fft
+
+_MIN_BLOCK_SIZE = 65536  # Smallest number of samples convolved with one transform
+
+
+@functools.lru_cache(maxsize=16)
+def load_impulse_response(file_path: str, frame_rate: int) -> np.ndarray:
+    """
+    Reads an impulse response from an audio file (e.g. WAV) as mono float32 samples at the given frame rate.
+    """
+    segment = AudioSegment.from_file(file_path).set_channels(1).set_frame_rate(frame_rate)
+    samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
+    return samples / (1 << (8 * segment.sample_width - 1))
+
+
+def exponential_impulse_response(frame_rate: int, reverb_time: float, decay: float) -> np.ndarray:
+    """
+    Returns an exponentially decaying impulse response of reverb_time seconds.
+    """
+    num_samples = max(int(frame_rate * reverb_time), 1)
+    return np.exp(-np.arange(num_samples) / (frame_rate * decay)).astype(np.float32)
+
+
+def impulse_response(impulse_response_key: tuple, frame_rate: int) -> np.ndarray:
+    """
+    Returns the impulse response described by the key, which is either ("file", file_path)
+    or ("exponential", reverb_time, decay).
+    """
+    match impulse_response_key:
+        case ("file", file_path):
+            return load_impulse_response(file_path, frame_rate)
+        case ("exponential", reverb_time, decay):
+            return exponential_impulse_response(frame_rate, reverb_time, decay)
+    raise ValueError(f"Unknown impulse response: {impulse_response_key}")
+
+
+@functools.lru_cache(maxsize=32)
+def _impulse_response_spectrum(impulse_response_key: tuple, frame_rate: int, fft_size: int) -> np.ndarray:
+    return fft.rfft(impulse_response(impulse_response_key, frame_rate), fft_size)
+
+
+class ConvolutionEngine:
+    """
+    Class to convolve a signal with an impulse response using FFT overlap-add.
+    The cost grows with N log M instead of N * M, so impulse responses of several seconds are usable.
+    The spectrum of the impulse response is cached per frame rate, and the tail of each block is carried
+    into the next call, so a signal can be processed block by block.
+    """
+
+    _block_size: int  # Number of samples convolved with one transform
+    _fft_size: int  # Size of the transforms
+    _spectrum: np.ndarray  # Spectrum of the impulse response
+    _tail: np.ndarray  # Part of the previous blocks' output which overlaps the next block
+
+    def __init__(self, impulse_response_key: tuple, frame_rate: int):
+        ir_length = len(impulse_response(impulse_response_key, frame_rate))
+        self._block_size = max(_MIN_BLOCK_SIZE, 1 << (ir_length - 1).bit_length())
+        self._fft_size = fft.next_fast_len(self._block_size + ir_length - 1, real=True)
+        self._spectrum = _impulse_response_spectrum(impulse_response_key, frame_rate, self._fft_size)
+        self._tail = np.zeros(ir_length - 1, dtype=np.float32)
+
+    def reset(self) -> None:
+        """
+        Clears the carried tail, so the next call of process starts a new signal.
+        """
+        self._tail = np.zeros_like(self._tail)
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Returns the convolution of the samples with the impulse response, with the length of the samples.
+        """
+        output = np.empty(len(samples), dtype=np.float32)
+        for start in range(0, len(samples), self._block_size):
+            block = samples[start:start + self._block_size]
+            convolved = fft.irfft(fft.rfft(block, self._fft_size) * self._spectrum, self._fft_size)
+            convolved = convolved[:len(block) + len(self._tail)].astype(np.float32)
+            convolved[:len(self._tail)] += self._tail
+            output[start:start + len(block)] = convolved[:len(block)]
+            self._tail = convolved[len(block):]
+        return output
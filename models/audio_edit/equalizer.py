@@ -1,8 +1,26 @@
+import copy
+import functools
+import os
+from collections.abc import Iterable
+from concurrent.futures import ThreadPoolExecutor
+
 import numpy as np
 from pydub import AudioSegment
 from pydub.utils import get_array_type
+from scipy import fft
+from scipy.signal import sosfilt
 from enum import Enum
 
+from models.audio_edit.render_cache import RenderCache
+
+_SPECTRUM_CACHE_MAX_BYTES = 256 * 1024 ** 2  # Memory budget of the kept spectra, about four of the longest ones
+_WHOLE_TRANSFORM_MAX_FRAMES = 1 << 23  # Longer signals are equalized in chunks instead of one transform
+_EQ_KERNEL_SIZE = 16384  # Taps of the FIR filter of the chunked equalizer
+_EQ_CHUNK_FRAMES = 65536  # Frames of one chunk of the chunked equalizer
+_EQ_TRANSFORM_SIZE = fft.next_fast_len(_EQ_CHUNK_FRAMES + _EQ_KERNEL_SIZE - 1, real=True)
+
+_chunk_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="equalizer-chunk")
+
 
 class Bands(Enum):
     """Enum class for the frequency bands of the equalizer."""
@@ -18,13 +36,27 @@ class Bands(Enum):
     HZ_16K = (8000, 16000)
 
 
+@functools.lru_cache(maxsize=32)
+def _band_bins(num_frames: int, fs: int) -> dict[Bands, tuple[int, int]]:
+    """
+    Returns the range of frequency bins of each band in a transform of num_frames frames.
+    """
+    freqs = np.fft.rfftfreq(num_frames, d=1 / fs)
+    return {band: (int(np.searchsorted(freqs, band.value[0], side='left')),
+                   int(np.searchsorted(freqs, band.value[1], side='right'))) for band in Bands}
+
+
+_spectrum_cache = RenderCache(max_size=_SPECTRUM_CACHE_MAX_BYTES,
+                              sizeof=lambda entry: entry[1].nbytes)  # Frame count and spectrum of a signal
+
+
 class Equalizer:
     """
     Class for the equalizer of the audio file.
-    Segment is the instance of the AudioFile.
+    Segment is the instance of the AudioFile. The equalizer only stores the band gains,
+    they are applied when the audio file is rendered.
     """
     _fs: int  # Frame rate of the audio
-    _samples: np.ndarray  # Array of audio samples
     _channels: int  # Number of audio channels
     _sample_width: int  # Sample width of the audio
     _gains: dict[Bands, float]  # Dictionary of gains for each frequency band
@@ -33,37 +65,191 @@ class Equalizer:
     def __init__(self, segment):
         self.segment = segment
         self._fs = segment.frame_rate
-        self._samples = np.array(segment.get_array_of_samples(), dtype=np.float32)
         self._channels = segment.channels
         self._sample_width = segment.sample_width
         self._gains = {band: 0.0 for band in Bands}
 
-    def change_band_gain(self, band: Bands, gain: float):
-        from models.audio_edit.AudioFile import AudioFile
-        freq_range = band.value
-        previous_gain = self._gains[band]
-        gain_change = gain                          #- previous_gain
-
-        samples = self._samples
-        sample_rate = self._fs
-
-        freqs = np.fft.rfftfreq(len(samples), d=1 / sample_rate)
-        fft_samples = np.fft.rfft(samples)
+    def bind(self, segment):
+        """
+        Returns a copy of the equalizer with the same gains for the given audio file.
+        Every audio file has its own equalizer, so edits started from it start from that audio file.
+        """
+        equalizer = copy.copy(self)
+        equalizer.segment = segment
+        equalizer._fs = segment.frame_rate
+        equalizer._channels = segment.channels
+        equalizer._sample_width = segment.sample_width
+        return equalizer
 
-        band_mask = (freqs >= freq_range[0]) & (freqs <= freq_range[1])
-        fft_samples[band_mask] *= 10 ** (gain_change / 20.0)
-
-        new_samples = np.fft.irfft(fft_samples)
-        new_samples = np.int16(new_samples / np.max(np.abs(new_samples)) * 32767)
-
-        new_segment = self.segment._spawn(new_samples.tobytes())
-
-        # Update the gain for the band
-        self._gains[band] = gain
-        self.segment = AudioFile.combine_with_audio_segment(self.segment, new_segment)
-
-        return self.segment
+    def change_band_gain(self, band: Bands, gain: float):
+        """
+        Returns the audio file to be rendered with the gain in dB set on the band.
+        The gains of this equalizer stay unchanged, so earlier versions of the audio file keep their sound.
+        """
+        equalizer = copy.copy(self)
+        equalizer._gains = self._gains | {band: gain}
+        return self.segment.edited(equalizer=equalizer)
+
+    def process(self, samples: np.ndarray, spectrum_key: tuple | None = None) -> np.ndarray:
+        """
+        Returns the interleaved float32 samples with the gains of all bands applied as one gain curve.
+        Every channel is transformed separately, the transforms of the channels run in parallel.
+        The spectrum is cached under the spectrum key, see process_cached. Long signals are equalized in chunks
+        and not cached, so their memory stays bounded by the chunk size.
+        """
+        if self.is_flat():
+            return samples
+
+        frames = samples.reshape(-1, self._channels)
+        if len(frames) > _WHOLE_TRANSFORM_MAX_FRAMES:
+            return self.process_chunked(frames).reshape(-1)
+        spectrum = fft.rfft(frames, axis=0, workers=-1)
+        if spectrum_key is not None:
+            _spectrum_cache.put(spectrum_key, (len(frames), spectrum))
+        return self._apply_gains(spectrum, len(frames))
+
+    def process_cached(self, spectrum_key: tuple) -> np.ndarray | None:
+        """
+        Returns the equalized samples of the signal whose spectrum is cached under the key,
+        or None if it is not cached. Changing a gain on the same signal so costs a multiplication
+        and one inverse transform, and the signal itself is not needed.
+        """
+        cached = _spectrum_cache.get(spectrum_key)
+        if cached is None:
+            return None
+        num_frames, spectrum = cached
+        return self._apply_gains(spectrum, num_frames)
+
+    def _apply_gains(self, spectrum: np.ndarray, num_frames: int) -> np.ndarray:
+        gain_curve = self.gain_curve(num_frames)
+        return fft.irfft(spectrum * gain_curve[:, np.newaxis], n=num_frames, axis=0,
+                         workers=-1).astype(np.float32, copy=False).reshape(-1)
+
+    def process_chunked(self, frames: np.ndarray) -> np.ndarray:
+        """
+        Returns the float32 frames of shape (frames, channels) equalized in chunks by overlap-add.
+        The gain curve is turned into a linear-phase FIR filter, so the transforms only cover one chunk
+        and their memory does not grow with the length of the track. Chunks are transformed in parallel.
+        """
+        kernel_spectrum = self._kernel_spectrum()
+        output = np.zeros(frames.shape, dtype=np.float32)
+        starts = range(0, len(frames), _EQ_CHUNK_FRAMES)
+        batch_size = os.cpu_count() or 1
+        for batch in range(0, len(starts), batch_size):
+            batch_starts = starts[batch:batch + batch_size]
+            spectra = _chunk_executor.map(lambda start: fft.rfft(
+                frames[start:start + _EQ_CHUNK_FRAMES], n=_EQ_TRANSFORM_SIZE, axis=0), batch_starts)
+            self._overlap_add(output, batch_starts, spectra, kernel_spectrum)
+        return output
+
+    @staticmethod
+    def _overlap_add(output: np.ndarray, starts: range, spectra: Iterable[np.ndarray],
+                     kernel_spectrum: np.ndarray) -> None:
+        """
+        Filters the chunks starting at starts, given by their spectra, and adds them to the output.
+        """
+        latency = _EQ_KERNEL_SIZE // 2
+        convolved = _chunk_executor.map(lambda spectrum: fft.irfft(
+            spectrum * kernel_spectrum[:, np.newaxis], n=_EQ_TRANSFORM_SIZE, axis=0), spectra)
+        for start, chunk in zip(starts, convolved):  # The chunks overlap, so they are added in order
+            chunk = chunk[:min(_EQ_CHUNK_FRAMES, len(output) - start) + _EQ_KERNEL_SIZE - 1]
+            begin = max(start - latency, 0)
+            chunk = chunk[begin - (start - latency):len(output) - (start - latency)]
+            output[begin:begin + len(chunk)] += chunk
+
+    def _kernel_spectrum(self) -> np.ndarray:
+        response = fft.irfft(self.gain_curve(_EQ_KERNEL_SIZE), n=_EQ_KERNEL_SIZE)
+        kernel = np.roll(response, _EQ_KERNEL_SIZE // 2) * np.hanning(_EQ_KERNEL_SIZE)
+        return fft.rfft(kernel.astype(np.float32), n=_EQ_TRANSFORM_SIZE)
+
+    def gain_curve(self, num_frames: int) -> np.ndarray:
+        """
+        Returns the linear gain of every frequency bin of a transform of num_frames frames.
+        """
+        gain_curve = np.ones(num_frames // 2 + 1, dtype=np.float32)
+        for band, (start, stop) in _band_bins(num_frames, self._fs).items():
+            if self._gains[band]:
+                gain_curve[start:stop] *= np.float32(10 ** (self._gains[band] / 20.0))
+        return gain_curve
+
+    def is_flat(self) -> bool:
+        """
+        Returns True if no band changes the audio.
+        """
+        return not any(self._gains.values())
 
     def get_all_bands(self):
         return self._gains
 
+
+@functools.lru_cache(maxsize=512)
+def band_biquad(band: Bands, gain: float, fs: int) -> np.ndarray:
+    """
+    Returns the biquad section (b0, b1, b2, a0, a1, a2) of the band with the gain in dB.
+    The lowest band is a low shelf, the highest band a high shelf and the other bands are
+    one octave wide peaking filters (RBJ audio EQ cookbook).
+    """
+    low, high = band.value
+    shelf = band in (Bands.HZ_62, Bands.HZ_16K)
+    f0 = (high if band == Bands.HZ_62 else low) if shelf else np.sqrt(low * high)
+    if not gain or f0 >= 0.45 * fs:
+        return np.array([[1.0, 0.0, 0.0, 1.0, 0.0, 0.0]])
+
+    a = 10 ** (gain / 40)
+    w0 = 2 * np.pi * f0 / fs
+    cos_w0 = np.cos(w0)
+    if not shelf:
+        alpha = np.sin(w0) / (2 * np.sqrt(2))  # Q of one octave
+        section = [1 + alpha * a, -2 * cos_w0, 1 - alpha * a, 1 + alpha / a, -2 * cos_w0, 1 - alpha / a]
+    else:
+        beta = 2 * np.sqrt(a) * np.sin(w0) / np.sqrt(2)  # Shelf slope of 1
+        sign = 1 if band == Bands.HZ_62 else -1
+        section = [a * ((a + 1) - sign * (a - 1) * cos_w0 + beta),
+                   sign * 2 * a * ((a - 1) - sign * (a + 1) * cos_w0),
+                   a * ((a + 1) - sign * (a - 1) * cos_w0 - beta),
+                   (a + 1) + sign * (a - 1) * cos_w0 + beta,
+                   -sign * 2 * ((a - 1) + sign * (a + 1) * cos_w0),
+                   (a + 1) + sign * (a - 1) * cos_w0 - beta]
+    section = np.array([section])
+    return section / section[0, 3]
+
+
+class LiveEqualizer:
+    """
+    Class for the equalizer applied to blocks of audio while they are played, without rendering the track.
+    Every band is a biquad filter. Changed gains are used from the next block on,
+    the filter state is kept, so a gain change does not click.
+    """
+    _fs: int  # Frame rate of the audio
+    _channels: int  # Number of audio channels
+    _gains: dict[Bands, float]  # Dictionary of gains for each frequency band
+    _sos: np.ndarray  # Biquad sections of all bands
+    _zi: np.ndarray  # Filter state of all sections and channels, carried between blocks
+
+    def __init__(self, fs: int, channels: int, gains: dict[Bands, float] | None = None):
+        self._fs = fs
+        self._channels = channels
+        self._zi = np.zeros((len(Bands), 2, channels))
+        self.set_gains(gains or {})
+
+    def set_gains(self, gains: dict[Bands, float]) -> None:
+        """
+        Sets the gains in dB of the bands, bands which are not given are flat.
+        """
+        self._gains = {band: float(gains.get(band, 0.0)) for band in Bands}
+        self._sos = np.concatenate([band_biquad(band, gain, self._fs) for band, gain in self._gains.items()])
+
+    def reset(self) -> None:
+        """
+        Clears the filter state, so the next block starts a new signal.
+        """
+        self._zi = np.zeros_like(self._zi)
+
+    def process(self, block: np.ndarray) -> np.ndarray:
+        """
+        Returns the float32 block of shape (frames, channels) with the gains of all bands applied.
+        """
+        if not any(self._gains.values()):
+            return block
+        filtered, self._zi = sosfilt(self._sos, block, axis=0, zi=self._zi)
+        return filtered.astype(np.float32, copy=False)
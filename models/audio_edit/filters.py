@@ -1,9 +1,15 @@
+import functools
 from enum import Enum, StrEnum
 
 import numpy as np
-from scipy.signal import butter, lfilter
+from scipy.signal import butter, sosfilt
 import abc
 
+from models.audio_edit.convolution import ConvolutionEngine
+
+
+_FLANGER_BLOCK_SIZE = 262144  # Samples processed at once by the flanger, bounds its temporary arrays
+
 
 class FilterType(Enum):
     LOW_PASS = "Low Pass"
@@ -12,167 +18,263 @@ class FilterType(Enum):
     REVERB = "Reverb"
     FLANGER = "Flanger"
 
-    def create_filter(self, audio):
+    @property
+    def parameters(self) -> dict[str, int | float]:
+        """
+        Returns the parameters the filter of this type is created with.
+        """
         match self:
             case FilterType.LOW_PASS:
-                return LowPassFilter(audio, 5000, 5).apply()
+                return {"cutoff": 5000, "order": 5}
             case FilterType.HIGH_PASS:
-                return HighPassFilter(audio, 200, 5).apply()
+                return {"cutoff": 200, "order": 5}
             case FilterType.ECHO:
-                return EchoFilter(audio, delay_ms=500, decay_factor=0.5).apply()
+                return {"delay_ms": 500, "decay_factor": 0.5}
             case FilterType.REVERB:
-                return ReverbFilter(audio).apply()
+                return {"reverb_time": 0.02, "decay": 0.3}
             case FilterType.FLANGER:
-                return FlangerFilter(audio, delay_ms=5, speed=0.5).apply()
+                return {"delay_ms": 5, "speed": 0.5}
+
+    def get_filter(self, audio):
+        """
+        Returns the filter of this type for the given audio, without applying it.
+        """
+        match self:
+            case FilterType.LOW_PASS:
+                return LowPassFilter(audio, **self.parameters)
+            case FilterType.HIGH_PASS:
+                return HighPassFilter(audio, **self.parameters)
+            case FilterType.ECHO:
+                return EchoFilter(audio, **self.parameters)
+            case FilterType.REVERB:
+                return ReverbFilter(audio, **self.parameters)
+            case FilterType.FLANGER:
+                return FlangerFilter(audio, **self.parameters)
+
+
+def cast_to_scaled_int16(samples: np.ndarray, gain: float = 1.0) -> np.ndarray:
+    """
+    Casts the samples to 16-bit integers and scales them to the range of -32768 to 32767.
+    The gain is applied in the same pass, samples pushed above full scale by it are clipped.
+    """
+    max_val = np.max(np.abs(samples)) if len(samples) else 0
+    if max_val == 0:
+        return np.zeros(len(samples), dtype=np.int16)
+    scaled = samples * np.float32(32767 / max_val * gain)
+    if gain > 1:
+        np.clip(scaled, -32768, 32767, out=scaled)
+    return scaled.astype(np.int16)
+
+
+def clip_to_int16(samples: np.ndarray) -> np.ndarray:
+    """
+    Casts float samples in the range of -1 to 1 to 16-bit integers, clipping the samples outside of it.
+    Unlike cast_to_scaled_int16 it does not need the whole signal, so it can quantise blocks of a stream.
+    """
+    return np.clip(samples * 32768, -32768, 32767).astype(np.int16)
 
 
 class BaseFilter(metaclass=abc.ABCMeta):
     """
     Abstract base class for audio filters.
-    Audio is instance of AudioFile
+    Audio is instance of AudioFile. Filters work on float32 samples, so a chain of filters
+    is quantised to 16-bit only once, when the audio file is rendered.
     """
 
-    samples: np.ndarray  # Array of audio samples
     fs: int  # Frame rate of the audio
 
     def __init__(self, audio):
         self.audio = audio
-        self.samples = np.array(audio.get_array_of_samples())
         self.fs = audio.frame_rate
 
+    def reset(self) -> None:
+        """
+        Clears the state carried between calls of process, so the next call starts a new signal.
+        """
+        pass
+
     @abc.abstractmethod
-    def apply(self):
+    def process(self, samples: np.ndarray) -> np.ndarray:
         """
-        Applies the filter to the audio.
+        Returns the filtered float32 samples. The given samples are not modified.
+        Consecutive calls continue the signal of the previous call, so a signal can be filtered block by block.
         """
         pass
 
+    def process_in_place(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Like process, but the filter may write the result into the given float32 samples.
+        """
+        return self.process(samples)
+
     def cast_to_scaled_int16(self, samples: np.ndarray) -> np.ndarray:
         """
         Casts the samples to 16-bit integers and scales them to the range of -32768 to 32767.
         """
-        max_val = np.max(np.abs(samples))
-        return np.int16(samples / max_val * 32767)
+        return cast_to_scaled_int16(samples)
 
 
-class LowPassFilter(BaseFilter):
-    cutoff: int  # Cutoff frequency for the filter
-    order: int  # Order of the filter
+@functools.lru_cache(maxsize=64)
+def butterworth_sos(btype: str, cutoff: float, order: int, fs: int) -> np.ndarray:
+    """
+    Returns the second-order sections of a digital Butterworth filter.
+    Designs are cached, so filters with the same parameters are designed only once.
+    """
+    return butter(order, cutoff / (0.5 * fs), btype=btype, analog=False, output='sos')
 
-    def __init__(self, audio, cutoff: int = 5000, order: int = 5):
+
+class SOSFilter(BaseFilter):
+    """
+    Class for IIR filters run as a cascade of second-order sections.
+    Consecutive filters can be merged into one cascade, which filters the samples in a single pass.
+    """
+
+    sos: np.ndarray  # Second-order sections of the filter
+    _zi: np.ndarray  # Filter state carried between blocks
+
+    def __init__(self, audio, sos: np.ndarray):
         super().__init__(audio)
-        self.cutoff = cutoff
-        self.order = order
+        self.sos = sos
+        self.reset()
+
+    def reset(self) -> None:
+        self._zi = np.zeros((len(self.sos), 2))
 
-    def apply(self):
+    def cascade(self, other: 'SOSFilter') -> 'SOSFilter':
         """
-        Apply the low pass filter to the audio.
+        Returns a filter with the sections of this filter followed by the sections of the other filter.
         """
-        from models.audio_edit.AudioFile import AudioFile
-        nyq = 0.5 * self.fs
-        normal_cutoff = self.cutoff / nyq
-        b, a = butter(self.order, normal_cutoff, btype='low', analog=False)
-        filtered_samples = lfilter(b, a, self.samples)
+        return SOSFilter(self.audio, np.vstack((self.sos, other.sos)))
 
-        filtered_samples_bytes = self.cast_to_scaled_int16(filtered_samples).tobytes()
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Apply the filter to the samples.
+        """
+        filtered, self._zi = sosfilt(self.sos, samples, zi=self._zi)
+        return filtered.astype(np.float32, copy=False)
 
-        return AudioFile.combine_with_audio_segment(self.audio, self.audio._spawn(filtered_samples_bytes))
 
+class ButterworthFilter(SOSFilter):
+    """
+    Base class for Butterworth filters.
+    """
 
-class HighPassFilter(BaseFilter):
+    btype: str  # Type of the filter passed to butter
     cutoff: int  # Cutoff frequency for the filter
     order: int  # Order of the filter
-    def __init__(self, audio, cutoff: int = 200, order: int = 5):
-        super().__init__(audio)
+
+    def __init__(self, audio, cutoff: int, order: int):
         self.cutoff = cutoff
         self.order = order
+        super().__init__(audio, butterworth_sos(self.btype, cutoff, order, audio.frame_rate))
 
-    def apply(self):
-        """
-        Apply the high pass filter to the audio.
-        """
-        from models.audio_edit.AudioFile import AudioFile
 
-        nyq = 0.5 * self.fs
-        normal_cutoff = self.cutoff / nyq
-        b, a = butter(self.order, normal_cutoff, btype='high', analog=False)
-        filtered_samples = lfilter(b, a, self.samples)
+class LowPassFilter(ButterworthFilter):
+    btype = 'low'
+
+    def __init__(self, audio, cutoff: int = 5000, order: int = 5):
+        super().__init__(audio, cutoff, order)
+
 
-        filtered_samples_bytes = self.cast_to_scaled_int16(filtered_samples).tobytes()
+class HighPassFilter(ButterworthFilter):
+    btype = 'high'
 
-        return AudioFile.combine_with_audio_segment(self.audio, self.audio._spawn(filtered_samples_bytes))
+    def __init__(self, audio, cutoff: int = 200, order: int = 5):
+        super().__init__(audio, cutoff, order)
 
 
 class EchoFilter(BaseFilter):
     delay_ms: int  # Delay in milliseconds
     decay_factor: float  # Decay factor for the echo
+    _history: np.ndarray  # Last input samples of the previous block, read by the delay line
 
     def __init__(self, audio, delay_ms: int = 500, decay_factor: float = 0.5):
         super().__init__(audio)
         self.delay_ms = delay_ms
         self.decay_factor = decay_factor
+        self.reset()
+
+    def reset(self) -> None:
+        self._history = np.zeros(int(self.fs * self.delay_ms / 1000), dtype=np.float32)
 
-    def apply(self):
+    def process(self, samples: np.ndarray) -> np.ndarray:
         """
-        Apply the echo filter to the audio.
+        Apply the echo filter to the samples.
         """
-        from models.audio_edit.AudioFile import AudioFile
-
-        delay_samples = int(self.fs * self.delay_ms / 1000)
-        echo = np.zeros_like(self.samples)
-        echo[delay_samples:] = self.samples[:-delay_samples] * self.decay_factor
-        echo_samples = self.samples + echo
-
-        filtered_samples_bytes = self.cast_to_scaled_int16(echo_samples).tobytes()
+        return self.process_in_place(samples.astype(np.float32))
 
-        return AudioFile.combine_with_audio_segment(self.audio, self.audio._spawn(filtered_samples_bytes))
+    def process_in_place(self, samples: np.ndarray) -> np.ndarray:
+        delay_samples = len(self._history)
+        if delay_samples > 0:
+            extended = np.concatenate((self._history, samples))
+            samples += extended[:len(samples)] * np.float32(self.decay_factor)
+            self._history = extended[len(extended) - delay_samples:]
+        return samples
 
 
 class ReverbFilter(BaseFilter):
     reverb_time: float  # Reverb time in seconds
     decay: float  # Decay factor for the reverb
+    impulse_response_path: str | None  # Audio file with the impulse response, replaces the exponential one if set
+    _engine: ConvolutionEngine  # Convolution of the samples with the impulse response
 
-    def __init__(self, audio, reverb_time=0.02, decay=0.3):
+    def __init__(self, audio, reverb_time=0.02, decay=0.3, impulse_response_path: str | None = None):
         super().__init__(audio)
         self.reverb_time = reverb_time
         self.decay = decay
+        self.impulse_response_path = impulse_response_path
+        if impulse_response_path:
+            self._engine = ConvolutionEngine(("file", impulse_response_path), self.fs)
+        else:
+            self._engine = ConvolutionEngine(("exponential", reverb_time, decay), self.fs)
 
-    def apply(self):
+    def reset(self) -> None:
+        self._engine.reset()
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
         """
-        Apply the reverb filter to the audio.
+        Apply the reverb filter to the samples.
         """
-        from models.audio_edit.AudioFile import AudioFile
-
-        num_samples = int(self.fs * self.reverb_time)
-        impulse_response = np.exp(-np.arange(num_samples) / (self.fs * self.decay))
-        reverb_samples = np.convolve(self.samples, impulse_response, mode='full')[:len(self.samples)]
-
-        filtered_samples_bytes = self.cast_to_scaled_int16(reverb_samples).tobytes()
-
-        return AudioFile.combine_with_audio_segment(self.audio, self.audio._spawn(filtered_samples_bytes))
+        return self._engine.process(samples)
 
 
 class FlangerFilter(BaseFilter):
     delay_ms: int  # Delay in milliseconds
     speed: float  # Speed of the flanger effect
+    _history: np.ndarray  # Last input samples of the previous block, read by the delay line
+    _position: int  # Index of the next sample in the whole signal, keeps the LFO phase across blocks
 
     def __init__(self, audio, delay_ms=5, speed=0.5):
         super().__init__(audio)
         self.delay_ms = delay_ms
         self.speed = speed
+        self.reset()
 
-    def apply(self):
+    def reset(self) -> None:
+        self._history = np.zeros(int(self.fs * self.delay_ms / 1000), dtype=np.float32)
+        self._position = 0
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
         """
-        Apply the flanger filter to the audio.
+        Apply the flanger filter to the samples. The delay of the whole block is computed from the LFO at once.
         """
-        from models.audio_edit.AudioFile import AudioFile
-
-        flanger_samples = np.copy(self.samples)
-        max_delay_samples = int(self.fs * self.delay_ms / 1000)
-        for i in range(max_delay_samples, len(flanger_samples)):
-            delay = int(max_delay_samples * (1 + np.sin(2 * np.pi * i * self.speed / self.fs)) / 2)
-            flanger_samples[i] += flanger_samples[i - delay] * 0.5
-
-        filtered_samples_bytes = self.cast_to_scaled_int16(flanger_samples).tobytes()
-
-        return AudioFile.combine_with_audio_segment(self.audio, self.audio._spawn(filtered_samples_bytes))
+        return self.process_in_place(samples.astype(np.float32))
+
+    def process_in_place(self, samples: np.ndarray) -> np.ndarray:
+        for start in range(0, len(samples), _FLANGER_BLOCK_SIZE):
+            self._process_block(samples[start:start + _FLANGER_BLOCK_SIZE])
+        return samples
+
+    def _process_block(self, samples: np.ndarray) -> None:
+        max_delay_samples = len(self._history)
+        positions = np.arange(self._position, self._position + len(samples))
+        phase = (positions * (self.speed / self.fs)) % 1.0
+        delays = (max_delay_samples * (1 + np.sin(2 * np.pi * phase)) / 2).astype(np.int64)
+
+        extended = np.concatenate((self._history, samples))
+        delayed = extended[np.arange(max_delay_samples, len(extended)) - delays]
+        delayed[positions < max_delay_samples] = 0  # The first samples have no full delay line yet
+        samples += delayed * np.float32(0.5)
+
+        self._history = extended[len(extended) - max_delay_samples:]
+        self._position += len(samples)
@@ -0,0 +1,78 @@
+import os
+from collections.abc import Iterable, Iterator
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from models.audio_edit.filters import BaseFilter, FilterType, SOSFilter, clip_to_int16
+
+_channel_executor = ThreadPoolExecutor(max_workers=os.cpu_count(), thread_name_prefix="filter-channel")
+
+
+class FilterPipeline:
+    """
+    Class to apply a chain of filters to a signal block by block.
+    Every filter carries its state (filter memory, delay lines, reverb tails) between blocks,
+    so the blocks give the same result as filtering the whole signal at once, with constant memory.
+    The chain is compiled once: adjacent IIR filters are merged into one cascade of second-order sections,
+    and the filters after the first one work in place on the buffer of the chain.
+    Every channel has its own chain, the channels are filtered concurrently on a thread pool.
+    """
+
+    channels: int  # Number of channels of the interleaved samples
+    chains: list[list[BaseFilter]]  # Compiled filters of each channel, applied in order
+
+    def __init__(self, audio, filter_types: list[FilterType]):
+        self.channels = audio.channels
+        self.chains = [self.compile([filter_type.get_filter(audio) for filter_type in filter_types])
+                       for _ in range(self.channels)]
+
+    @staticmethod
+    def compile(filters: list[BaseFilter]) -> list[BaseFilter]:
+        """
+        Returns the filters with every run of adjacent IIR filters merged into a single filter.
+        """
+        compiled = []
+        for audio_filter in filters:
+            if compiled and isinstance(compiled[-1], SOSFilter) and isinstance(audio_filter, SOSFilter):
+                compiled[-1] = compiled[-1].cascade(audio_filter)
+            else:
+                compiled.append(audio_filter)
+        return compiled
+
+    def reset(self) -> None:
+        """
+        Clears the state of all filters, so the next block starts a new signal.
+        """
+        for chain in self.chains:
+            for audio_filter in chain:
+                audio_filter.reset()
+
+    def process(self, samples: np.ndarray) -> np.ndarray:
+        """
+        Returns the interleaved float32 samples of the block filtered by the whole chain.
+        """
+        if not self.chains[0]:
+            return samples
+        if self.channels == 1:
+            return self._process_channel(self.chains[0], samples)
+        frames = samples.reshape(-1, self.channels)
+        filtered = _channel_executor.map(self._process_channel, self.chains,
+                                         [frames[:, channel] for channel in range(self.channels)])
+        return np.stack(list(filtered), axis=1).reshape(-1)
+
+    @staticmethod
+    def _process_channel(chain: list[BaseFilter], samples: np.ndarray) -> np.ndarray:
+        for index, audio_filter in enumerate(chain):
+            samples = audio_filter.process(samples) if index == 0 else audio_filter.process_in_place(samples)
+        return samples
+
+    def stream(self, blocks: Iterable[np.ndarray]) -> Iterator[np.ndarray]:
+        """
+        Filters blocks of 16-bit samples of shape (frames, channels) and yields the filtered 16-bit blocks.
+        Samples above full scale are clipped, as the peak of the whole signal is not known while streaming.
+        """
+        for block in blocks:
+            frames, channels = block.shape
+            samples = block.reshape(-1).astype(np.float32) / np.float32(32768)
+            yield clip_to_int16(self.process(samples)).reshape(frames, channels)
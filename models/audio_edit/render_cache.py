@@ -0,0 +1,93 @@
+import threading
+from collections import OrderedDict
+from collections.abc import Callable
+from dataclasses import dataclass, field
+
+from models.audio_edit.filters import FilterType
+
+
+@dataclass
+class RenderCache:
+    """
+    Class to keep rendered audio data in memory, keyed by the source content and the edits rendered on it.
+    The least recently used renders are dropped once the cache grows above max_size.
+    """
+    max_size: int = 512 * 1024 ** 2  # Memory budget of the cached renders in bytes
+    sizeof: Callable[[object], int] = len  # Returns the size of a cached entry in bytes
+    hits: int = 0  # Number of renders served from the cache
+    misses: int = 0  # Number of renders which had to be computed
+    _entries: OrderedDict[tuple, object] = field(default_factory=OrderedDict)  # Cached data, least recent first
+    _size: int = 0  # Size of all cached renders in bytes
+    _lock: threading.Lock = field(default_factory=threading.Lock)  # Guards the entries across render threads
+
+    @staticmethod
+    def filtered_key(source, filters: list[FilterType]) -> tuple:
+        """
+        Returns the key of the source audio file with only the filters applied.
+        """
+        return (source.content_hash(), source.frame_rate, source.channels, source.sample_width,
+                tuple((filter_type.value, tuple(filter_type.parameters.items())) for filter_type in filters))
+
+    @staticmethod
+    def key(source, filters: list[FilterType], equalizer, volume: float) -> tuple:
+        """
+        Returns the key of the source audio file rendered with the given edits.
+        """
+        return (RenderCache.filtered_key(source, filters),
+                tuple(sorted((band.name, gain) for band, gain in equalizer.get_all_bands().items() if gain)), volume)
+
+    def get(self, key: tuple):
+        """
+        Returns the cached render for the key, or None if it is not cached.
+        """
+        with self._lock:
+            data = self._entries.get(key)
+            if data is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return data
+
+    def put(self, key: tuple, data) -> None:
+        """
+        Stores the render for the key, dropping the least recently used renders if needed.
+        """
+        size = self.sizeof(data)
+        if size > self.max_size:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._size -= self.sizeof(self._entries.pop(key))
+            self._entries[key] = data
+            self._size += size
+            self._evict()
+
+    def set_max_size(self, max_size: int) -> None:
+        """
+        Changes the memory budget and drops renders which no longer fit.
+        """
+        with self._lock:
+            self.max_size = max_size
+            self._evict()
+
+    def clear(self) -> None:
+        """
+        Removes all renders and resets the counters.
+        """
+        with self._lock:
+            self._entries.clear()
+            self._size = 0
+            self.hits = self.misses = 0
+
+    @property
+    def size(self) -> int:
+        return self._size
+
+    def _evict(self) -> None:
+        while self._entries and self._size > self.max_size:
+            _, data = self._entries.popitem(last=False)
+            self._size -= self.sizeof(data)
+
+
+render_cache = RenderCache()  # Cache shared by all renders of audio files
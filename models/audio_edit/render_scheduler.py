@@ -0,0 +1,151 @@
+import copy
+import multiprocessing
+import os
+from collections.abc import Iterable
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from dataclasses import dataclass, field
+from multiprocessing import resource_tracker, shared_memory
+
+from models.audio_edit.AudioFile import AudioFile
+
+
+@dataclass
+class _SourceHandle:
+    """
+    Class to hand the source of a render to a worker process without pickling its samples.
+    The samples are read from the raw PCM file they are memory mapped from, or from a shared memory block.
+    """
+    frame_rate: int  # Frame rate of the source
+    sample_width: int  # Sample width of the source
+    channels: int  # Number of channels of the source
+    content_hash: str  # Hash of the source samples, so the worker does not hash them again
+    raw_file: str | None = None  # Raw PCM file of a memory mapped source
+    block_name: str | None = None  # Shared memory block holding the samples of any other source
+    size: int = 0  # Number of bytes of the samples in the block
+
+    @classmethod
+    def create(cls, source: AudioFile) -> tuple["_SourceHandle", shared_memory.SharedMemory | None]:
+        """
+        Returns the handle of the source and the shared memory block created for it, which the caller unlinks.
+        """
+        handle = cls(source.frame_rate, source.sample_width, source.channels, source.content_hash())
+        if source.raw_file is not None:  # A cache entry evicted since it was mapped is passed in shared memory
+            handle.raw_file = source.raw_file
+            return handle, None
+        data = source._data
+        block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+        block.buf[:len(data)] = data
+        handle.block_name, handle.size = block.name, len(data)
+        return handle, block
+
+    def open(self) -> AudioFile:
+        if self.raw_file is not None:
+            source = AudioFile.from_raw_file(self.raw_file, self.frame_rate, self.sample_width, self.channels)
+        else:
+            block = shared_memory.SharedMemory(name=self.block_name)
+            try:
+                data = bytes(block.buf[:self.size])
+            finally:
+                block.close()
+            source = AudioFile(data, frame_rate=self.frame_rate, sample_width=self.sample_width,
+                               channels=self.channels)
+        source._content_hash = self.content_hash
+        return source
+
+
+def _detach(audio_file: AudioFile) -> AudioFile:
+    """
+    Returns a copy of the pending audio file without its source, to be pickled for a worker.
+    """
+    detached = copy.copy(audio_file)
+    detached.source = None
+    detached.equalizer = audio_file.equalizer.bind(detached)  # The equalizer refers back to its audio file
+    return detached
+
+
+def _render_to_shared_memory(audio_file: AudioFile, source: _SourceHandle) -> tuple[str, int]:
+    """
+    Renders the audio file in a worker process into a new shared memory block.
+    Returns the name of the block and the size of the render, the block is unlinked by the caller.
+    """
+    audio_file.source = source.open()
+    data = audio_file.compute_render()
+    block = shared_memory.SharedMemory(create=True, size=max(len(data), 1))
+    resource_tracker.unregister(block._name, "shared_memory")  # Owned by the caller from now on
+    block.buf[:len(data)] = data
+    block.close()
+    return block.name, len(data)
+
+
+def _read_shared_memory(name: str, size: int) -> bytes:
+    block = shared_memory.SharedMemory(name=name)
+    try:
+        return bytes(block.buf[:size])
+    finally:
+        block.close()
+        block.unlink()
+
+
+@dataclass
+class RenderScheduler:
+    """
+    Class to render the edits of many audio files at once on a pool of worker processes.
+    Only the edits are pickled for the workers: sources are opened from their raw PCM file
+    or passed in shared memory, and renders are returned through shared memory.
+    Renders which are already cached are not sent to the workers.
+    """
+    max_workers: int = os.cpu_count() or 1  # Number of worker processes
+    _executor: ProcessPoolExecutor | None = field(default=None, repr=False)  # Started on the first parallel render
+
+    def render(self, audio_files: Iterable[AudioFile]) -> None:
+        """
+        Renders the pending edits of the audio files. A single pending render is computed in this process.
+        """
+        unique = {id(audio_file): audio_file for audio_file in audio_files}.values()
+        pending = [audio_file for audio_file in unique if not audio_file.render_from_cache()]
+        if len(pending) < 2 or self.max_workers < 2:
+            for audio_file in pending:
+                audio_file.set_rendered(audio_file.compute_render())
+            return
+
+        sources = {}  # Source, its handle and its shared memory block by the id of the source
+        futures = []
+        try:
+            for audio_file in pending:
+                source = audio_file._source_file()
+                if id(source) not in sources:
+                    sources[id(source)] = (source, *_SourceHandle.create(source))
+                futures.append(self._get_executor().submit(_render_to_shared_memory, _detach(audio_file),
+                                                           sources[id(source)][1]))
+            for audio_file, future in zip(pending, futures):
+                try:
+                    name, size = future.result()
+                except Exception as exception:  # The render is computed here instead, the playback must not fail
+                    if isinstance(exception, BrokenProcessPool):
+                        self.shutdown()
+                    audio_file.set_rendered(audio_file.compute_render())
+                    continue
+                audio_file.set_rendered(_read_shared_memory(name, size))
+        finally:
+            for _, _, block in sources.values():
+                if block is not None:
+                    block.close()
+                    block.unlink()
+
+    def shutdown(self) -> None:
+        """
+        Stops the worker processes. They are started again by the next parallel render.
+        """
+        if self._executor is not None:
+            self._executor.shutdown(cancel_futures=True)
+            self._executor = None
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        if self._executor is None:
+            # Spawned workers do not inherit the state of the GUI threads, which forked workers would
+            self._executor = ProcessPoolExecutor(self.max_workers, mp_context=multiprocessing.get_context("spawn"))
+        return self._executor
+
+
+render_scheduler = RenderScheduler()  # Scheduler shared by all renders of the players
@@ -0,0 +1,132 @@
+import hashlib
+import json
+import os
+from dataclasses import dataclass, field
+
+from pydub import AudioSegment
+
+from models.audio_edit.AudioFile import AudioFile
+
+_HASH_CHUNK_SIZE = 1024 * 1024  # Bytes read at once while hashing a source file
+_CACHE_VERSION = 1  # Bumped whenever the layout of the cache entries changes
+
+
+@dataclass
+class PCMCache:
+    """
+    Class to keep the decoded PCM of audio files on disk, so a repeated import is a memory map of the entry
+    instead of an ffmpeg decode. Entries are keyed by the content hash of the source file and the decode
+    parameters, and the least recently used ones are evicted once the cache grows above max_size.
+    """
+    directory: str = os.path.join(os.path.expanduser("~"), ".cache", "mp3_edit", "pcm")  # Location of the entries
+    max_size: int = 4 * 1024 ** 3  # Maximum size of all entries in bytes
+    _hashes: dict[tuple[str, int, int], str] = field(default_factory=dict)  # Content hashes of already hashed files
+
+    def load(self, file_path: str, frame_rate: int | None = None, channels: int | None = None,
+             sample_width: int | None = None) -> AudioFile:
+        """
+        Returns the decoded audio of the given file, decoding and storing it only on a cache miss.
+        The returned audio file is memory mapped from the cache entry whenever the entry could be written.
+        Parameters left as None keep the values of the source file.
+        """
+        key = self.key(file_path, frame_rate, channels, sample_width)
+        audio_file = self._read(key)
+        if audio_file is None:
+            segment = AudioSegment.from_file(file_path)
+            if frame_rate:
+                segment = segment.set_frame_rate(frame_rate)
+            if channels:
+                segment = segment.set_channels(channels)
+            if sample_width:
+                segment = segment.set_sample_width(sample_width)
+            self._write(key, segment)
+            self.evict()
+            audio_file = self._read(key) or AudioFile.from_segment(segment)
+        return audio_file
+
+    def key(self, file_path: str, frame_rate: int | None = None, channels: int | None = None,
+            sample_width: int | None = None) -> str:
+        """
+        Returns the cache key of the given file decoded with the given parameters.
+        """
+        return f"{self.content_hash(file_path)}_{frame_rate or 0}_{channels or 0}_{sample_width or 0}_v{_CACHE_VERSION}"
+
+    def content_hash(self, file_path: str) -> str:
+        """
+        Returns the hash of the file content. Files that did not change since the last call are not read again.
+        """
+        stat = os.stat(file_path)
+        stat_key = (os.path.abspath(file_path), stat.st_size, stat.st_mtime_ns)
+        if stat_key not in self._hashes:
+            digest = hashlib.blake2b(digest_size=20)
+            with open(file_path, 'rb') as f:
+                while chunk := f.read(_HASH_CHUNK_SIZE):
+                    digest.update(chunk)
+            self._hashes[stat_key] = digest.hexdigest()
+        return self._hashes[stat_key]
+
+    def size(self) -> int:
+        """
+        Returns the size of all cached PCM data in bytes.
+        """
+        return sum(os.path.getsize(path) for path in self._entries())
+
+    def evict(self) -> None:
+        """
+        Removes the least recently used entries until the cache fits in max_size.
+        """
+        entries = sorted(self._entries(), key=os.path.getmtime)
+        total = sum(os.path.getsize(path) for path in entries)
+        while entries and total > self.max_size:
+            path = entries.pop(0)
+            total -= os.path.getsize(path)
+            self._remove(path[:-len(".pcm")])
+
+    def clear(self) -> None:
+        """
+        Removes all entries from the cache.
+        """
+        for path in self._entries():
+            self._remove(path[:-len(".pcm")])
+
+    def _entries(self) -> list[str]:
+        if not os.path.isdir(self.directory):
+            return []
+        return [os.path.join(self.directory, name) for name in os.listdir(self.directory) if name.endswith(".pcm")]
+
+    def _read(self, key: str) -> AudioFile | None:
+        base = os.path.join(self.directory, key)
+        try:
+            with open(base + ".json", 'r') as f:
+                params = json.load(f)
+            audio_file = AudioFile.from_raw_file(base + ".pcm", frame_rate=params["frame_rate"],
+                                                 sample_width=params["sample_width"], channels=params["channels"])
+            audio_file._content_hash = key
+            os.utime(base + ".pcm")  # Marks the entry as recently used
+        except (OSError, ValueError):
+            return None
+        return audio_file
+
+    def _write(self, key: str, segment: AudioSegment) -> None:
+        base = os.path.join(self.directory, key)
+        params = {"frame_rate": segment.frame_rate, "sample_width": segment.sample_width,
+                  "channels": segment.channels}
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            with open(base + ".pcm.tmp", 'wb') as f:
+                f.write(segment.raw_data)
+            with open(base + ".json", 'w') as f:
+                json.dump(params, f)
+            os.replace(base + ".pcm.tmp", base + ".pcm")
+        except OSError as e:
+            print(f"Could not cache decoded audio: {e}")
+
+    def _remove(self, base: str) -> None:
+        for path in (base + ".pcm", base + ".json"):
+            try:
+                os.remove(path)
+            except OSError:  # Already removed or still memory mapped on Windows
+                pass
+
+
+pcm_cache = PCMCache()  # Cache shared by all reads of audio files
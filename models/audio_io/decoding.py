@@ -0,0 +1,31 @@
+from pydub.exceptions import CouldntDecodeError
+from pydub.utils import mediainfo_json
+
+_FLOAT_PLANAR_CODECS = ['mp3', 'mp4', 'aac', 'webm', 'ogg']  # Codecs which pydub decodes to 16-bit PCM
+
+
+def probe_audio_file(file_path: str) -> dict[str, int | float]:
+    """
+    Reads the stream parameters of an audio file with ffprobe, without decoding it.
+    The values match the ones pydub produces when the file is decoded.
+    """
+    info = mediainfo_json(file_path)
+    audio_streams = [stream for stream in info.get('streams', []) if stream.get('codec_type') == 'audio']
+    if not audio_streams:
+        raise CouldntDecodeError(f"No audio stream found in {file_path}")
+    stream = audio_streams[0]
+
+    if stream.get('sample_fmt') == 'fltp' and stream.get('codec_name') in _FLOAT_PLANAR_CODECS:
+        bits_per_sample = 16
+    else:
+        bits_per_sample = int(stream.get('bits_per_sample') or 16)
+
+    frame_rate = int(stream['sample_rate'])
+    duration = float(stream.get('duration') or info.get('format', {}).get('duration') or 0)
+    return {
+        "frame_rate": frame_rate,
+        "channels": int(stream['channels']),
+        "sample_width": 4 if bits_per_sample == 24 else bits_per_sample // 8,
+        "duration": duration,
+        "frames": round(duration * frame_rate),
+    }
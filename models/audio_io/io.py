@@ -1,11 +1,100 @@
+import subprocess
+import tempfile
+from collections.abc import Iterable, Iterator
+
+import numpy as np
+from pydub import AudioSegment
+from pydub.exceptions import CouldntDecodeError, CouldntEncodeError
+from pydub.utils import get_encoder_name
+
 from models.audio_edit.AudioFile import AudioFile
+from models.audio_edit.filters import FilterType
+from models.audio_edit.pipeline import FilterPipeline
+from models.audio_io.cache import PCMCache, pcm_cache
+from models.audio_io.decoding import probe_audio_file
+
+_STREAM_DTYPES = {1: np.int8, 2: np.int16, 4: np.int32}  # NumPy types of the streamed samples for each sample width
+
+
+def _read_log(log) -> str:
+    log.seek(0)
+    return log.read().decode('utf-8', 'ignore')
 
 
-def read_audio_file(file_path: str) -> AudioFile:
+def read_audio_file(file_path: str, cache: PCMCache | None = pcm_cache, lazy: bool = False) -> AudioFile:
     """
     Read an audio file from the given file path.
+    The decoded audio is taken from the cache if the same file was read before.
+    A lazy audio file is decoded only when its samples are used for the first time.
+    """
+    loader = cache.load if cache is not None else AudioSegment.from_file
+    return AudioFile.from_file(file_path, lazy=lazy, loader=loader)
+
+
+def stream_audio_file(file_path: str, block_frames: int = 65536, frame_rate: int | None = None,
+                      channels: int | None = None, sample_width: int = 2) -> Iterator[np.ndarray]:
+    """
+    Decode an audio file through an ffmpeg pipe and yield it in blocks of block_frames frames,
+    as arrays of shape (frames, channels). Only the last block can be shorter.
+    Frame rate and channels left as None keep the values of the source file.
+    """
+    if frame_rate is None or channels is None:
+        info = probe_audio_file(file_path)
+        frame_rate = frame_rate or info["frame_rate"]
+        channels = channels or info["channels"]
+
+    sample_format = "s8" if sample_width == 1 else f"s{sample_width * 8}le"
+    command = [get_encoder_name(), '-nostdin', '-v', 'error', '-i', file_path, '-vn', '-f', sample_format,
+               '-acodec', f"pcm_{sample_format}", '-ar', str(frame_rate), '-ac', str(channels), '-']
+    log = tempfile.TemporaryFile()  # Not a pipe, a full pipe would block ffmpeg while the blocks are read
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, stderr=log)
+    frame_width = channels * sample_width
+    try:
+        while block := process.stdout.read(block_frames * frame_width):
+            usable = len(block) - len(block) % frame_width
+            yield np.frombuffer(block[:usable], dtype=_STREAM_DTYPES[sample_width]).reshape(-1, channels)
+        if process.wait() != 0:
+            raise CouldntDecodeError(f"Decoding failed: {_read_log(log)}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.stdout.close()
+        process.wait()
+        log.close()
+
+
+def stream_filtered_audio_file(file_path: str, filter_types: list[FilterType],
+                               block_frames: int = 65536) -> Iterator[np.ndarray]:
+    """
+    Decode an audio file block by block and yield the 16-bit blocks with the filters applied,
+    so the filters run with constant memory on tracks of any length.
+    """
+    audio_file = AudioFile.from_file(file_path, lazy=True)
+    pipeline = FilterPipeline(audio_file, filter_types)
+    yield from pipeline.stream(stream_audio_file(file_path, block_frames, audio_file.frame_rate, audio_file.channels))
+
+
+def write_audio_stream(blocks: Iterable[np.ndarray], file_path: str, frame_rate: int, channels: int,
+                       file_format: str = "mp3") -> None:
+    """
+    Encode blocks of 16-bit samples of shape (frames, channels) through an ffmpeg pipe,
+    without holding the whole audio in memory.
     """
-    return AudioFile.from_file(file_path)
+    command = [get_encoder_name(), '-y', '-nostdin', '-v', 'error', '-f', 's16le', '-ar', str(frame_rate),
+               '-ac', str(channels), '-i', '-', '-f', file_format, file_path]
+    log = tempfile.TemporaryFile()  # Not a pipe, a full pipe would block ffmpeg while the blocks are written
+    process = subprocess.Popen(command, stdin=subprocess.PIPE, stderr=log)
+    try:
+        for block in blocks:
+            process.stdin.write(np.ascontiguousarray(block, dtype=np.int16).tobytes())
+        process.stdin.close()
+        if process.wait() != 0:
+            raise CouldntEncodeError(f"Encoding failed: {_read_log(log)}")
+    finally:
+        if process.poll() is None:
+            process.kill()
+        process.wait()
+        log.close()
 
 
 def write_audio_file(audio_file: AudioFile, file_path: str, file_format: str = "mp3") -> None:
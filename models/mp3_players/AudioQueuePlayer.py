@@ -1,11 +1,19 @@
-import pygame
-from pydub import AudioSegment
-
 import pygame
 from models.audio_edit.AudioFile import AudioFile
 from models.audio_edit.equalizer import Bands
 from models.audio_edit.filters import FilterType
 from models.mp3_players.Player import Player
+from models.mp3_players.Timeline import Clip, Timeline
+
+
+def init_mixer(frame_rate: int, channels: int) -> None:
+    """
+    Initialises the mixer for signed 16-bit audio with the given format, unless it already uses it.
+    Sounds in the format of the mixer are played without conversion.
+    """
+    if pygame.mixer.get_init() != (frame_rate, -16, channels):
+        pygame.mixer.quit()
+        pygame.mixer.init(frequency=frame_rate, size=-16, channels=channels)
 
 
 class AudioQueuePlayer(Player):
@@ -19,15 +27,27 @@ class AudioQueuePlayer(Player):
     _sound: pygame.mixer.Sound | None  # Sound object to play the sound file
     _is_playing: bool  # Flag to check if the sound file is playing
     _paused: bool  # Flag to check if playback is paused
+    revision: int  # Incremented on every change of the sounds, their order, delays or edits
+    _sound_revisions: dict[str, int]  # Revision of the player at the last change of every sound
+    _combined: tuple | None  # Revision and format of the player when the timeline was built
+    _clips: dict[str, Clip]  # Clip of every sound on the timeline, to equalize it while it plays
 
     def __init__(self):
         super().__init__()
-        pygame.mixer.init()
         self.sound_files = {}
         self.play_order = []
         self._channel = None
         self._paused = False
         self._sound = None
+        self.revision = 0
+        self._sound_revisions = {}
+        self._combined = None
+        self._clips = {}
+
+    def _touch(self, sound_id: str | None = None) -> None:
+        self.revision += 1
+        if sound_id is not None:
+            self._sound_revisions[sound_id] = self.revision  # Never reused, also for a removed and re-added id
 
     def load(self, sound_id: str, audio_file: AudioFile, delay: int = 0) -> None:
         """
@@ -38,30 +58,53 @@ class AudioQueuePlayer(Player):
         audio_file.delay = delay
         self.sound_files[sound_id] = audio_file
         self.play_order.append(sound_id)
+        self._touch(sound_id)
 
 
-    def combine_audio_files(self) -> None:
+    def combine_audio_files(self, frame_rate: int | None = None, channels: int | None = None) -> None:
         """
         Combine all audio files in the play_order into one, adding silence for delays.
+        The combined audio is 16-bit in the given format, the format of the sounds is kept if not given.
+        Only the timeline is built here, the final audio is rendered when it is needed as a whole.
+        Nothing is done if the player did not change since the last combine in the same format,
+        so the timeline and the final audio rendered from it are reused. Otherwise the sounds which
+        did not change keep the converted samples of their clips.
+        """
+        if self.is_combined(frame_rate, channels):
+            return
+        sounds = [self.sound_files[sound_id] for sound_id in self.play_order]
+        combined_revision = self._combined[0] if self._combined is not None else -1
+        unchanged = [self._clips.get(sound_id) if self._sound_revisions.get(sound_id, 0) <= combined_revision
+                     else None for sound_id in self.play_order]
+        self.timeline = Timeline(sounds, frame_rate, channels, sample_width=2, previous_clips=unchanged)
+        self._clips = dict(zip(self.play_order, self.timeline.clips))
+        self.final_audio = None
+        self._sound = None
+        self._combined = (self.revision, frame_rate, channels)
+
+    def is_combined(self, frame_rate: int | None = None, channels: int | None = None) -> bool:
         """
-        combined_audio = AudioSegment.silent(duration=0)
-        for sound_id in self.play_order:
-            audio_file = self.sound_files[sound_id]
-            # Add silence before appending the next audio file
-            if audio_file.delay > 0:
-                silence = AudioSegment.silent(duration=audio_file.delay * 1000)  # Delay in milliseconds
-                combined_audio += silence
-            combined_audio += audio_file
+        Check if the timeline is up to date with the sounds, their order, delays and edits in the given format.
+        """
+        return self.timeline is not None and self._combined == (self.revision, frame_rate, channels)
 
-        self.final_audio = AudioFile.from_segment(combined_audio)
-        self._sound = pygame.mixer.Sound(self.final_audio.to_buffer())
+    def _get_sound(self) -> pygame.mixer.Sound:
+        """
+        Returns the combined audio as a pygame sound. Its samples are handed to the mixer as they are,
+        so the mixer is initialised with the format of the combined audio.
+        """
+        if self._sound is None:
+            final_audio = self.get_final_audio()
+            init_mixer(final_audio.frame_rate, final_audio.channels)
+            self._sound = pygame.mixer.Sound(buffer=final_audio.raw_data)
+        return self._sound
 
     def play(self) -> None:
         """
         Play the combined audio file that includes all sounds and silences.
         """
-        if not self.is_playing and self.final_audio:
-            self._channel = self._sound.play()
+        if not self.is_playing and self.timeline:
+            self._channel = self._get_sound().play()
 
     def pause(self) -> None:
         """
@@ -92,6 +135,7 @@ class AudioQueuePlayer(Player):
         Set the order in which the sounds should be played.
         """
         self.play_order = play_order
+        self._touch()
 
     def apply_filter(self, sound_id: str, filter_type: FilterType) -> None:
         """
@@ -99,6 +143,15 @@ class AudioQueuePlayer(Player):
         """
         if sound_id in self.sound_files:
             self.sound_files[sound_id] = self.sound_files[sound_id].apply_filter(filter_type)
+            self._touch(sound_id)
+
+    def remove_filters(self, sound_id: str) -> None:
+        """
+        Remove all filters from the audio file corresponding to the given sound_id.
+        """
+        if sound_id in self.sound_files:
+            self.sound_files[sound_id] = self.sound_files[sound_id].remove_filters()
+            self._touch(sound_id)
 
     def set_volume_on_sound(self, sound_id: str, volume: float) -> None:
         """
@@ -106,6 +159,7 @@ class AudioQueuePlayer(Player):
         """
         if sound_id in self.sound_files:
             self.sound_files[sound_id] = self.sound_files[sound_id].set_volume(volume)
+            self._touch(sound_id)
 
     def set_delay_on_sound(self, sound_id: str, delay: int) -> None:
         """
@@ -113,6 +167,7 @@ class AudioQueuePlayer(Player):
         """
         if sound_id in self.sound_files:
             self.sound_files[sound_id].delay = delay
+            self._touch(sound_id)
 
     def set_volume(self, volume: float) -> None:
         """
@@ -123,11 +178,13 @@ class AudioQueuePlayer(Player):
 
     def set_time(self, time: float) -> None:
         """
-        Set the playback time in milliseconds.
+        Set the playback time in seconds. The sound is created from a view of the samples from that time on.
         """
-        if self.final_audio and self._channel:
+        if self.timeline and self._channel:
             self._channel.stop()  # Stop current playback
-            self._sound = pygame.mixer.Sound(buffer=self.final_audio[time * 1000:].raw_data)
+            final_audio = self.get_final_audio()
+            frame = min(round(time * final_audio.frame_rate), int(final_audio.frame_count()))
+            self._sound = pygame.mixer.Sound(buffer=memoryview(final_audio.raw_data)[frame * final_audio.frame_width:])
             self._channel = self._sound.play()
             self._channel.pause() if self._channel else None
 
@@ -143,6 +200,8 @@ class AudioQueuePlayer(Player):
             self.sound_files.pop(sound_id)
             if sound_id in self.play_order:
                 self.play_order.remove(sound_id)
+            self._sound_revisions.pop(sound_id, None)
+            self._touch()
 
     def get_audio_delay(self, sound_id: str) -> int:
         """
@@ -170,10 +229,14 @@ class AudioQueuePlayer(Player):
 
     def set_band_on_audio(self, sound_id: str, band: Bands, value: float) -> None:
         """
-        Set the band of the equalizer.
+        Set the band of the equalizer. A playing clip of the sound is equalized with the new gains
+        from its next block on, without rendering the sound.
         """
         if sound_id in self.sound_files:
             self.sound_files[sound_id] = self.sound_files[sound_id].set_value_on_band(band, value)
+            self._touch(sound_id)
+            if sound_id in self._clips:
+                self._clips[sound_id].set_gains(self.sound_files[sound_id].get_all_bands())
 
     def get_all_bands_from_audio(self, sound_id: str) -> dict[Bands, float]:
         """
@@ -187,15 +250,16 @@ class AudioQueuePlayer(Player):
         """
         Export the combined audio file to a file.
         """
-        final_audio = self.final_audio
-        if not final_audio:
+        if self._combined is None:
             self.combine_audio_files()
-        self.final_audio.export(file_path, format=format)
-        self.final_audio = final_audio
+        else:
+            self.combine_audio_files(*self._combined[1:])  # Only rebuilt if the sounds changed since
+        self.get_final_audio().export(file_path, format=format)
 
     def init_player(self) -> None:
         """
-        Initialize the player for playback.
+        Initialize the player for playback. Playing the player initializes the mixer itself,
+        when the player is only mixed by the mixing engine pygame is never initialized.
         """
         pygame.mixer.init()
 
@@ -206,8 +270,12 @@ class AudioQueuePlayer(Player):
         return state
 
     def __setstate__(self, state):
+        state.setdefault('timeline', None)
+        state.setdefault('revision', 0)
+        state.setdefault('_sound_revisions', {sound_id: 0 for sound_id in state['sound_files']})
         self.__dict__.update(state)
         self._channel = None
         self._sound = None
-        self._paused = False
-        self.init_player()
\ No newline at end of file
+        self._combined = None  # The renders of a loaded project are not trusted, the first combine rebuilds all
+        self._clips = {}
+        self._paused = False
\ No newline at end of file
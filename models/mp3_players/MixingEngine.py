@@ -0,0 +1,165 @@
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+
+import numpy as np
+import pyaudio
+
+from models.mp3_players.Timeline import Timeline
+
+_PREFETCH_SECONDS = 5  # Clips starting this far ahead of the playhead are decoded and converted in the background
+
+
+class MixingEngine:
+    """
+    Class to play several timelines in sync through a single output stream.
+    The output callback reads one block of every timeline at the same position and sums them,
+    so the timelines stay sample-accurate and the work per callback depends only on the block size.
+    The mix is never built as a whole: the blocks are generated from the clips and silences of the timelines
+    just in time. Only the clips heard first are prepared before the playback starts,
+    the clips ahead of the playhead are prepared in a background thread and released once they are played.
+    """
+
+    _format: int  # Format of the output stream
+    _chunk: int  # Frames per block of the output stream
+    _frame_rate: int  # Frame rate of the timelines and the output stream
+    _channels: int  # Number of channels of the timelines and the output stream
+    _timelines: list[Timeline]  # Timelines mixed together
+    _position: int  # Next frame to be played
+    _length: int  # Number of frames of the longest timeline
+    _volume: float  # Volume of the mix, from 0 to 1
+    _lock: threading.Lock  # Guards the position and the timelines against the output callback
+    _stream: pyaudio.Stream | None  # Output stream
+    _audio: pyaudio.PyAudio  # PyAudio instance
+    _prefetcher: ThreadPoolExecutor  # Thread preparing the clips ahead of the playhead
+    _prefetching: Future | None  # Running preparation of the clips
+
+    def __init__(self, format: int = pyaudio.paInt16, chunk: int = 1024):
+        self._format = format
+        self._chunk = chunk
+        self._frame_rate = 44100
+        self._channels = 2
+        self._timelines = []
+        self._position = 0
+        self._length = 0
+        self._volume = 1.0
+        self._lock = threading.Lock()
+        self._stream = None
+        self._audio = pyaudio.PyAudio()
+        self._prefetcher = ThreadPoolExecutor(max_workers=1, thread_name_prefix="mixing-prefetch")
+        self._prefetching = None
+
+    def load(self, timelines: list[Timeline]) -> None:
+        """
+        Stops the playback and loads the 16-bit timelines, which must share one frame rate and channel count.
+        """
+        self.stop()
+        with self._lock:
+            self._timelines = timelines
+            self._position = 0
+            for timeline in timelines:
+                timeline.reset()
+            self._length = max((timeline.length for timeline in timelines), default=0)
+            if timelines:
+                self._frame_rate = timelines[0].frame_rate
+                self._channels = timelines[0].channels
+
+    def play(self) -> None:
+        """
+        Start the playback from the current position with callback.
+        The clips heard first are prepared before the stream asks for them.
+        """
+        self._prefetch(self._position)
+        if self._stream is None:
+            self._stream = self._audio.open(format=self._format, channels=self._channels, rate=self._frame_rate,
+                                            output=True, frames_per_buffer=self._chunk,
+                                            stream_callback=self.playback_callback)
+        self.resume()
+
+    def pause(self) -> None:
+        """
+        Pause the playback, keeping the position.
+        """
+        if self._stream is not None and self._stream.is_active():
+            self._stream.stop_stream()
+
+    def resume(self) -> None:
+        """
+        Resume the paused playback.
+        """
+        if self._stream is not None and not self._stream.is_active() and self._position < self._length:
+            self._stream.stop_stream()  # A stream finished by the callback has to be stopped before a restart
+            self._stream.start_stream()
+
+    def stop(self) -> None:
+        """
+        Stop the playback, close the stream and rewind to the start.
+        """
+        if self._stream is not None:
+            self._stream.stop_stream()
+            self._stream.close()
+            self._stream = None
+        with self._lock:
+            self._position = 0
+            for timeline in self._timelines:
+                timeline.reset()
+
+    def seek(self, frame: int) -> None:
+        """
+        Moves the playback to the frame. Only the playhead moves, nothing is copied or rendered,
+        the clips around the new position are prepared in the background.
+        """
+        with self._lock:
+            self._position = min(max(frame, 0), self._length)
+            for timeline in self._timelines:
+                timeline.reset()  # The equalizer state of the old position would ring into the new one
+        self._prefetching = self._prefetcher.submit(self._prefetch, self._position)
+
+    def set_volume(self, volume: float) -> None:
+        self._volume = volume
+
+    @property
+    def frame_rate(self) -> int:
+        return self._frame_rate
+
+    @property
+    def position(self) -> int:
+        return self._position
+
+    @property
+    def is_playing(self) -> bool:
+        return self._stream is not None and self._stream.is_active()
+
+    def mix(self, frames: int) -> np.ndarray:
+        """
+        Returns the next frames of the mix as 16-bit samples of shape (frames, channels) and advances the position.
+        """
+        with self._lock:
+            start = self._position
+            self._position = min(start + frames, self._length)
+            mixed = np.zeros((frames, self._channels), dtype=np.float32)
+            for timeline in self._timelines:
+                mixed += timeline.read(start, frames)
+        if self._prefetching is None or self._prefetching.done():
+            self._prefetching = self._prefetcher.submit(self._prefetch, start + frames)
+        mixed *= np.float32(self._volume)
+        return np.clip(mixed, -32768, 32767).astype(np.int16)
+
+    def _prefetch(self, start: int) -> None:
+        for timeline in self._timelines:
+            timeline.prefetch(start, _PREFETCH_SECONDS * self._frame_rate)
+
+    def playback_callback(self, in_data: bytes | None, frame_count: int, time_info: dict,
+                          status: int) -> tuple[bytes, int]:
+        """
+        Callback function to fill the output stream with the next block of the mix.
+        """
+        finished = self._position + frame_count >= self._length
+        return self.mix(frame_count).tobytes(), pyaudio.paComplete if finished else pyaudio.paContinue
+
+    def terminate(self) -> None:
+        """
+        Stop the playback and release the audio device.
+        """
+        self.stop()
+        self._prefetcher.shutdown(cancel_futures=True)
+        self._audio.terminate()
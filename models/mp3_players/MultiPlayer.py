@@ -1,84 +1,106 @@
 from pydub import AudioSegment
 
+from models.mp3_players.MixingEngine import MixingEngine
 from models.mp3_players.Player import Player
-from models.timers.Timer import Timer
 
 
 class MultiPlayer:
     """
     Class to manage multiple audio players.
+    The players are mixed by one mixing engine, so they play in sync through a single output stream.
     """
 
     players: dict[str, Player]  # Dict of Player objects
-    _timer: Timer | None  # Timer object to manage the playback time
+    _engine: MixingEngine  # Engine mixing the timelines of all players
 
     def __init__(self):
         self.players = {}
-        self._timer = None
+        self._engine = MixingEngine()
 
     def add_player(self, player_name: str, player: Player) -> None:
         """Adds a player to the player list."""
         self.players[player_name] = player
 
-    def play_all(self, volume: float) -> None:
-        self._timer = Timer()
-        for _, player in self.players.items():
-            player.play()
+    def get_format(self) -> tuple[int, int]:
+        """Returns the highest frame rate and channel count of all sounds, the format the players are mixed in."""
+        sounds = [sound for player in self.players.values() for sound in player.sound_files.values()]
+        frame_rate = max((sound.frame_rate for sound in sounds), default=44100)
+        channels = max((sound.channels for sound in sounds), default=2)
+        return frame_rate, channels
 
+    def combine_audio_files(self) -> None:
+        """Combines the audio files of every player in the format of the project.
+        Players which did not change since the last combine keep their timelines."""
+        frame_rate, channels = self.get_format()
+        for player in self.players.values():
+            player.combine_audio_files(frame_rate, channels)
+
+    def play_all(self, volume: float) -> None:
+        self._engine.load([player.timeline for player in self.players.values() if player.timeline is not None])
         self.set_volume(volume)
-        self._timer.start()
+        self._engine.play()
 
     def pause_all(self) -> None:
-        for _, player in self.players.items():
-            player.pause()
-        self._timer.pause()
+        self._engine.pause()
 
     def resume_all(self) -> None:
-        for _, player in self.players.items():
-            player.resume()
-        self._timer.resume()
+        self._engine.resume()
 
     def stop_all(self) -> None:
-        for _, player in self.players.items():
-            player.stop()
-        self._timer.stop()
+        self._engine.stop()
 
     def export(self, file_path: str, format="mp3") -> None:
         """Combines all audio files from all players into one and exports them to a single file."""
-
-        combined_audio = AudioSegment.silent(duration=self.get_max_length())
+        self.combine_audio_files()  # The players are exported with their current sounds, even if never played
+        frame_rate, channels = self.get_format()
+        combined_audio = AudioSegment.silent(duration=self.get_max_length(), frame_rate=frame_rate).set_channels(channels)
 
         for _, player in self.players.items():
-            if isinstance(player.final_audio, AudioSegment):
-                combined_audio = combined_audio.overlay(player.final_audio)
+            final_audio = player.get_final_audio()
+            if isinstance(final_audio, AudioSegment):
+                combined_audio = combined_audio.overlay(final_audio)
             else:
                 raise ValueError("player.final_audio is not an instance of AudioSegment")
 
         combined_audio.export(file_path, format=format)
 
     def get_time(self) -> tuple[int, int, int]:
-        hours, minutes, seconds = self._timer.get_time()
-        return round(hours), round(minutes), round(seconds)
+        """Returns the hours, minutes and seconds of the frame being played."""
+        seconds = self._engine.position / self._engine.frame_rate
+        return int(seconds // 3600), int(seconds % 3600 // 60), int(seconds % 60)
 
     def get_max_length(self) -> float:
         max_length = 0
         for _, player in self.players.items():
-            max_length = max(max_length, len(player.final_audio))
+            if player.timeline is not None:
+                max_length = max(max_length, player.timeline.duration_ms)
         return max_length
 
     @property
     def is_playing(self) -> bool:
-        return any([player.is_playing for _, player in self.players.items()])
+        return self._engine.is_playing
 
     def set_time(self, time: float) -> None:
-        for _, player in self.players.items():
-            player.set_time(time)
-        self._timer.set_time(time)
+        """Moves the playback of all players to the time in seconds."""
+        self._engine.seek(round(time * self._engine.frame_rate))
 
     def remove_player(self, player_name: str) -> None:
         """Removes the selected player from the player list."""
         self.players.pop(player_name)
 
     def set_volume(self, volume: float) -> None:
-        for _, player in self.players.items():
-            player.set_volume(volume)
+        self._engine.set_volume(volume)
+
+    def terminate(self) -> None:
+        """Stops the playback and releases the audio device, the multiplayer can not be played afterwards."""
+        self._engine.terminate()
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        del state['_engine']
+        return state
+
+    def __setstate__(self, state):
+        state.pop('_timer', None)  # Projects saved before the mixing engine kept a timer
+        self.__dict__.update(state)
+        self._engine = MixingEngine()
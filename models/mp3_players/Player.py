@@ -1,12 +1,23 @@
 from models.audio_edit.AudioFile import AudioFile
+from models.mp3_players.Timeline import Timeline
 import abc
 
 
 class Player(metaclass=abc.ABCMeta):
     final_audio: AudioFile | None  # Final audio file to be played
+    timeline: Timeline | None  # Placement of the sounds of the final audio, read block by block for mixing
 
     def __init__(self):
         self.final_audio = None
+        self.timeline = None
+
+    def get_final_audio(self) -> AudioFile | None:
+        """
+        Returns the final audio, rendered from the timeline the first time it is needed.
+        """
+        if self.final_audio is None and self.timeline is not None:
+            self.final_audio = self.timeline.render()
+        return self.final_audio
 
     @abc.abstractmethod
     def load(self, sound_id: str, audio_file: AudioFile, delay: int = 0) -> None:
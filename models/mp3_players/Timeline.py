@@ -0,0 +1,215 @@
+import bisect
+import dataclasses
+from dataclasses import dataclass, field
+
+import numpy as np
+from pydub import AudioSegment
+
+from models.audio_edit.AudioFile import AudioFile
+from models.audio_edit.equalizer import LiveEqualizer
+from models.audio_edit.pipeline import FilterPipeline
+
+_RENDER_BLOCK_FRAMES = 1 << 16  # Frames of a clip processed at once when the whole timeline is rendered
+
+
+@dataclass
+class Clip:
+    """
+    Class for a sound placed on the timeline.
+    The clip is streamed from the source of the sound: the source is converted to the format of the timeline
+    when the clip is prepared, and the filters, the volume and the equalizer are applied block by block
+    while the clip is read, so no render of the whole sound is kept. A prepared clip keeps the converted source,
+    its filters, which carry their state between read blocks, and the gain of its volume.
+    """
+    sound: AudioFile  # Sound with all edits, in its own format
+    start: int  # First frame of the clip on the timeline
+    frames: int  # Number of frames of the clip
+    equalizer: LiveEqualizer  # Equalizer of the sound, applied to the filtered samples while the clip is read
+    sample_format: tuple[int, int, int]  # Frame rate, channels and sample width of the timeline
+    _stream: tuple[np.ndarray, FilterPipeline, float] | None = field(default=None, repr=False)  # Prepared clip
+
+    @property
+    def end(self) -> int:
+        return self.start + self.frames
+
+    def prepare(self) -> None:
+        """
+        Converts the source of the sound and sets up its filters, so the clip can be read.
+        """
+        if self._stream is None:
+            self._stream = self._open()
+
+    def release(self) -> None:
+        """
+        Drops the converted samples, the clip is silent until it is prepared again.
+        """
+        self._stream = None
+
+    def reset(self) -> None:
+        """
+        Clears the state of the filters and the equalizer, so the next read block starts a new signal.
+        """
+        stream = self._stream
+        if stream is not None:
+            stream[1].reset()
+        self.equalizer.reset()
+
+    def read(self, offset: int, frames: int) -> np.ndarray | None:
+        """
+        Returns the frames from the offset in the clip on with all edits, of shape (frames, channels),
+        or None if the clip is not prepared. The blocks are expected to be read in order.
+        """
+        stream = self._stream
+        if stream is None:
+            return None
+        samples, pipeline, gain = stream
+        return self._process(samples[offset:offset + frames], pipeline, gain, self.equalizer)
+
+    def render(self) -> np.ndarray:
+        """
+        Returns all frames of the clip with all edits, the same as reading the clip from its start on.
+        The filters and the equalizer have their own state, so a playing clip is not disturbed.
+        """
+        samples, pipeline, gain = self._open(self._stream[0] if self._stream is not None else None)
+        frame_rate, channels, _ = self.sample_format
+        equalizer = LiveEqualizer(frame_rate, channels, self.sound.equalizer.get_all_bands())
+        rendered = np.empty_like(samples)
+        for begin in range(0, len(samples), _RENDER_BLOCK_FRAMES):
+            rendered[begin:begin + _RENDER_BLOCK_FRAMES] = self._process(
+                samples[begin:begin + _RENDER_BLOCK_FRAMES], pipeline, gain, equalizer)
+        return rendered
+
+    def _open(self, samples: np.ndarray | None = None) -> tuple[np.ndarray, FilterPipeline, float]:
+        frame_rate, channels, sample_width = self.sample_format
+        if self.sound.source is None:  # An unedited sound is its own source
+            source, filters, gain = self.sound, [], 1.0
+        else:
+            source, filters, gain = self.sound._source_file(), self.sound.filters, self.sound.volume_gain
+        if samples is None:
+            samples = self._convert(source)
+        audio_format = AudioFile(b'', frame_rate=frame_rate, channels=channels, sample_width=sample_width)
+        return samples, FilterPipeline(audio_format, filters), gain
+
+    @staticmethod
+    def _process(samples: np.ndarray, pipeline: FilterPipeline, gain: float, equalizer: LiveEqualizer) -> np.ndarray:
+        full_scale = np.float32(1 << (8 * samples.itemsize - 1))
+        filtered = pipeline.process(samples.reshape(-1).astype(np.float32) / full_scale)
+        equalized = equalizer.process(filtered.reshape(samples.shape) * np.float32(gain * full_scale))
+        limits = np.iinfo(samples.dtype)
+        return np.clip(equalized, limits.min, limits.max).astype(samples.dtype)
+
+    def _convert(self, sound: AudioFile) -> np.ndarray:
+        frame_rate, channels, sample_width = self.sample_format
+        if (sound.frame_rate, sound.channels, sound.sample_width) != self.sample_format:
+            sound = sound.set_frame_rate(frame_rate).set_channels(channels).set_sample_width(sample_width)
+        samples = sound.get_samples_view().reshape(-1, channels)
+        if len(samples) != self.frames:  # Resampling may round the length differently than the timeline
+            fitted = np.zeros((self.frames, channels), dtype=samples.dtype)
+            fitted[:min(len(samples), self.frames)] = samples[:self.frames]
+            samples = fitted
+        return samples
+
+    def set_gains(self, gains: dict) -> None:
+        """
+        Sets the gains of the equalizer of the clip, they are heard from the next read block on.
+        """
+        self.equalizer.set_gains(gains)
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['_stream'] = None  # Prepared again from the sound when it is played
+        return state
+
+
+class Timeline:
+    """
+    Class to place a queue of sounds one after another, each after its delay in seconds.
+    Unless they are given, the frame rate, channels and sample width are the highest of all sounds,
+    like when pydub appends segments. Placing the sounds needs only their lengths: a clip is prepared
+    when the playhead comes close to it and released once it is behind, so playback keeps only the clips
+    around the playhead in memory. Blocks read for playback are filtered and equalized from the sources
+    of the clips, so the gains of a clip can change while it plays. The whole timeline is rendered by streaming
+    every clip the same way into one preallocated buffer. The previous clips are the clips of an earlier timeline
+    for the sounds which did not change since, None for the others, and keep their samples in the same format.
+    """
+
+    frame_rate: int  # Frame rate of the timeline
+    channels: int  # Number of channels of the timeline
+    sample_width: int  # Sample width of the timeline
+    clips: list[Clip]  # Clips in the order of the queue
+    length: int  # Number of frames of the timeline
+    _starts: list[int]  # First frame of every clip, for the search of the clips in a range
+
+    def __init__(self, sounds: list[AudioFile], frame_rate: int | None = None, channels: int | None = None,
+                 sample_width: int | None = None, previous_clips: list[Clip | None] | None = None):
+        silence = AudioSegment.silent(duration=0)  # Format of the empty segment the queue was appended to
+        self.frame_rate = frame_rate or max([silence.frame_rate] + [sound.frame_rate for sound in sounds])
+        self.channels = channels or max([silence.channels] + [sound.channels for sound in sounds])
+        self.sample_width = sample_width or max([silence.sample_width] + [sound.sample_width for sound in sounds])
+
+        self.clips = []
+        position = 0
+        sample_format = (self.frame_rate, self.channels, self.sample_width)
+        for sound, previous in zip(sounds, previous_clips or [None] * len(sounds)):
+            position += round(max(sound.delay, 0) * self.frame_rate)
+            equalizer = LiveEqualizer(self.frame_rate, self.channels, sound.equalizer.get_all_bands())
+            if previous is not None and previous.sample_format == sample_format:
+                self.clips.append(dataclasses.replace(previous, start=position, equalizer=equalizer))
+            else:
+                frames = round(sound.frame_count() * self.frame_rate / sound.frame_rate)
+                self.clips.append(Clip(sound, position, frames, equalizer, sample_format))
+            position += self.clips[-1].frames
+        self.length = position
+        self._starts = [clip.start for clip in self.clips]
+
+    @property
+    def duration_ms(self) -> float:
+        return self.length * 1000 / self.frame_rate
+
+    def read(self, start: int, frames: int) -> np.ndarray:
+        """
+        Returns the samples of the frames from start on, of shape (frames, channels), for playback.
+        The clips carry the state of their filters and equalizers, so the blocks are expected to be read in order.
+        Nothing is converted here: frames outside of every clip and of clips which are not prepared yet are silent.
+        """
+        block = np.zeros((frames, self.channels), dtype=np.dtype(f"int{8 * self.sample_width}"))
+        for clip in self._clips_between(start, start + frames):
+            begin, stop = max(start, clip.start), min(start + frames, clip.end)
+            samples = clip.read(begin - clip.start, stop - begin)
+            if samples is not None:
+                block[begin - start:stop - start] = samples
+        return block
+
+    def reset(self) -> None:
+        """
+        Clears the state of the filters and the live equalizers, so the next read block starts a new signal.
+        """
+        for clip in self.clips:
+            clip.reset()
+
+    def prefetch(self, start: int, frames: int) -> None:
+        """
+        Prepares the clips in the frames from start on, so they are heard once the playhead reaches them.
+        All other clips are released, behind the playhead or far ahead of it after a seek.
+        """
+        for clip in self.clips:
+            if clip.start < start + frames and start < clip.end:
+                clip.prepare()
+            else:
+                clip.release()
+
+    def _clips_between(self, start: int, end: int) -> list[Clip]:
+        first = max(bisect.bisect_right(self._starts, start) - 1, 0)
+        return [clip for clip in self.clips[first:bisect.bisect_left(self._starts, end)]
+                if clip.start < end and start < clip.end]
+
+    def render(self) -> AudioFile:
+        """
+        Renders the whole timeline into one audio file. The clips are processed like when they are read
+        for playback, with the same filters, equalizers and gain staging, so the export sounds like the playback.
+        """
+        data = np.zeros((self.length, self.channels), dtype=np.dtype(f"int{8 * self.sample_width}"))
+        for clip in self.clips:
+            data[clip.start:clip.end] = clip.render()
+        return AudioFile(data.tobytes(), frame_rate=self.frame_rate, sample_width=self.sample_width,
+                         channels=self.channels)
@@ -18,7 +18,7 @@ class AudioVisualizer:
         AudioFile constructor.
         """
         self._audio_file = audio_file
-        self._samples = np.array(self._audio_file.get_array_of_samples())
+        self._samples = self._audio_file.get_samples_view()
         self._frame_rate = self._audio_file.frame_rate
 
     def plot_waveform(self, file_path: str) -> None:
@@ -1,4 +1,4 @@
-from pydub import AudioSegment
+from models.audio_edit.AudioFile import AudioFile
 import librosa
 import librosa.display
 import numpy as np
@@ -7,13 +7,13 @@ from .utils import convert_to_librosa_format
 
 
 class RhythmicAnalysis:
-    _audio_segment: AudioSegment  # AudioSegment object
+    _audio_segment: AudioFile  # AudioFile object
     _y: np.ndarray  # Audio signal as numpy array
     _sr: int  # Sample rate of the audio signal
 
-    def __init__(self, audio_segment: AudioSegment):
+    def __init__(self, audio_segment: AudioFile):
         self._audio_segment = audio_segment
-        self._y, self._sr = convert_to_librosa_format(audio_segment.get_array_of_samples(), audio_segment.channels,
+        self._y, self._sr = convert_to_librosa_format(audio_segment.get_samples_view(), audio_segment.channels,
                                                       audio_segment.frame_rate)
 
     def analyze_tempogram(self, file_path: str) -> None:
@@ -1,4 +1,5 @@
-from pydub import AudioSegment, silence
+from pydub import silence
+from models.audio_edit.AudioFile import AudioFile
 import librosa
 import numpy as np
 import matplotlib.pyplot as plt
@@ -6,13 +7,13 @@ from .utils import convert_to_librosa_format
 
 
 class SegmentationAnalysis:
-    _audio_segment: AudioSegment  # AudioSegment object
+    _audio_segment: AudioFile  # AudioFile object
     _y: np.ndarray  # Audio signal
     _sr: int  # Sample rate
 
-    def __init__(self, audio_segment: AudioSegment):
+    def __init__(self, audio_segment: AudioFile):
         self._audio_segment = audio_segment
-        self._y, self._sr = convert_to_librosa_format(audio_segment.get_array_of_samples(), audio_segment.channels,
+        self._y, self._sr = convert_to_librosa_format(audio_segment.get_samples_view(), audio_segment.channels,
                                                       audio_segment.frame_rate)
 
     def _detect_silence_segments(self, min_silence_len: int = 1000, silence_thresh: int = -40) -> list[
@@ -5,7 +5,7 @@ def convert_to_librosa_format(array_of_samples: np.ndarray, channels: int, frame
     """Converts AudioSegment to librosa format (numpy array and sample rate)"""
 
     # Convert AudioSegment to numpy array
-    samples = np.array(array_of_samples)
+    samples = np.asarray(array_of_samples)
     if channels == 2:
         samples = samples.reshape((-1, 2)).mean(axis=1)  # Convert stereo to mono
     y = samples.astype(np.float32)
@@ -0,0 +1,27 @@
+import numpy as np
+
+from models.audio_edit.AudioFile import AudioFile
+from models.audio_edit.equalizer import Bands
+from models.audio_edit.filters import FilterType
+
+
+def make_audio_file() -> AudioFile:
+    samples = (np.random.default_rng(0).standard_normal(44100 * 2) * 3000).astype(np.int16)
+    return AudioFile.from_segment(AudioFile(samples.tobytes(), frame_rate=44100, sample_width=2, channels=2))
+
+
+def test_edit_one_version_twice():
+    audio_file = make_audio_file()
+    quieter = audio_file.set_volume(50)
+    equalized = audio_file.set_value_on_band(Bands.HZ_1K, 6)
+    assert equalized.volume == 100 and quieter.volume == 50
+    assert audio_file.equalizer.is_flat() and quieter.equalizer.is_flat()
+
+    filtered = audio_file.apply_filter(FilterType.LOW_PASS)
+    equalized = audio_file.set_value_on_band(Bands.HZ_2K, 3)
+    assert equalized.filters == [] and filtered.filters == [FilterType.LOW_PASS]
+    assert filtered.set_value_on_band(Bands.HZ_2K, 3).filters == [FilterType.LOW_PASS]
+
+
+if __name__ == "__main__":
+    test_edit_one_version_twice()
@@ -49,9 +49,8 @@ def multi_player_test():
 def single_player_test():
     player = AudioQueuePlayer()
     x = read_audio_file("10.mp3")
-    from models.audio_edit.filters import LowPassFilter,HighPassFilter
-    filter_ = HighPassFilter(x)
-    x = filter_.apply()
+    from models.audio_edit.filters import FilterType
+    x = x.apply_filter(FilterType.HIGH_PASS)
     player.load("sound1", x)
     player.combine_audio_files()
     player.play()